@@ -0,0 +1,86 @@
+"""Microbenchmark of the schedule-date expansion used by Transformer.transform_data
+
+Usage: python benchmark/bench_schedule_expansion.py [number_of_schedules] [years]
+"""
+import os
+import sys
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from transform import expand_schedule_dates
+
+def expand_schedule_dates_loop(df):
+    """Expand each schedule into one row per course session, one day at a time, the loop Transformer used before (reference implementation)"""
+    all_dates = []
+
+    for _, row in df.iterrows():
+        start_date = row['start_dt']
+        end_date = row['end_dt']
+        days_of_week = [int(day) for day in row['course_days'].split(',')]
+        current_date = start_date
+        while current_date <= end_date:
+            weekday = current_date.weekday()
+            custom_weekday = weekday + 1 % 7 + 1
+            if custom_weekday in days_of_week:
+                all_dates.append({
+                    'course_id': row['course_id'],
+                    'lecturer_id': row['lecturer_id'],
+                    'start_dt': row['start_dt'],
+                    'end_dt': row['end_dt'],
+                    'course_day': custom_weekday,
+                    'schedule_date': (current_date).strftime('%Y-%m-%d'),
+                    'week_number': ((current_date - start_date).days // 7) + 1
+                })
+            current_date += timedelta(days=1)
+
+    df = pd.DataFrame(all_dates)
+    df.reset_index(drop=True, inplace=True)
+    df.index += 1
+    df.index.name = 'id'
+    df.reset_index(inplace=True)
+    return df
+
+def make_schedules(number_of_schedules, years, seed=42):
+    """Build a parsed stg__schedules frame with random terms and course days"""
+    rng = np.random.default_rng(seed)
+    start_dt = pd.Timestamp('2019-09-09') + pd.to_timedelta(rng.integers(0, 365 * years, number_of_schedules), unit='D')
+    end_dt = start_dt + pd.to_timedelta(rng.integers(60, 180, number_of_schedules), unit='D')
+    course_days = [
+        ','.join(str(day) for day in sorted(rng.choice(np.arange(2, 8), rng.integers(1, 4), replace=False)))
+        for _ in range(number_of_schedules)
+    ]
+    df = pd.DataFrame({
+        'id': np.arange(1, number_of_schedules + 1),
+        'course_id': rng.integers(1, 500, number_of_schedules),
+        'lecturer_id': rng.integers(1, 200, number_of_schedules),
+        'start_dt': pd.to_datetime(start_dt.strftime('%d-%b-%y'), format="%d-%b-%y"),
+        'end_dt': pd.to_datetime(end_dt.strftime('%d-%b-%y'), format="%d-%b-%y"),
+        'course_days': course_days,
+    })
+    return df
+
+def timed(function, df):
+    start_time = time.perf_counter()
+    result = function(df.copy())
+    return result, time.perf_counter() - start_time
+
+def main():
+    number_of_schedules = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    years = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    df = make_schedules(number_of_schedules, years)
+
+    loop_result, loop_seconds = timed(expand_schedule_dates_loop, df)
+    vectorized_result, vectorized_seconds = timed(expand_schedule_dates, df)
+    pd.testing.assert_frame_equal(loop_result, vectorized_result)
+
+    print(f"{number_of_schedules} schedules -> {len(vectorized_result)} sessions (outputs identical)")
+    print(f"loop:       {loop_seconds:8.3f} s")
+    print(f"vectorized: {vectorized_seconds:8.3f} s ({loop_seconds / vectorized_seconds:,.0f}x faster)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""Deterministic synthetic source data in the format of the files in source/
+
+Usage: python benchmark/generate_data.py OUTPUT_DIR [--students N] [--courses N] [--weeks N]
+                                          [--terms N] [--attendance-rate R] [--seed N]
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+DATE_FORMAT = '%d-%b-%y'
+FIRST_TERM_START = pd.Timestamp('2019-09-09')
+COURSES_PER_STUDENT = 4
+ATTENDANCE_CHUNK_ROWS = 1_000_000
+
+def term_starts(terms):
+    """Monday on which every term starts, two terms per academic year"""
+    starts = []
+    for term in range(terms):
+        year, semester = divmod(term, 2)
+        if semester == 0:
+            starts.append(FIRST_TERM_START + pd.DateOffset(years=year))
+        else:
+            starts.append(pd.Timestamp('2020-01-27') + pd.DateOffset(years=year))
+    # Shift to the Monday of that week so week numbers line up with the term start
+    return [start - pd.Timedelta(days=start.weekday()) for start in starts]
+
+def write_csv(path, header, rows, quoted_columns=()):
+    """Write rows with the header and quoting of the source files (CRLF line endings)"""
+    with open(path, 'w', newline='') as file:
+        file.write(','.join(header) + '\r\n')
+        for row in rows:
+            values = [f'"{value}"' if index in quoted_columns else str(value) for index, value in enumerate(row)]
+            file.write(','.join(values) + '\r\n')
+
+def generate(output_dir, students=100, courses=10, weeks=13, terms=2, attendance_rate=0.8, seed=42):
+    """Generate courses.csv, schedules.csv, enrollments.csv and attendances.csv into output_dir"""
+    rng = np.random.default_rng(seed)
+    os.makedirs(output_dir, exist_ok=True)
+
+    write_csv(
+        os.path.join(output_dir, 'courses.csv'),
+        ['ID', 'NAME'],
+        ((course_id, f"Course {course_id}") for course_id in range(1, courses + 1))
+    )
+
+    # One schedule per course and term, meeting on one to three weekdays (2 = Monday ... 6 = Friday)
+    schedules = []
+    for term, start in enumerate(term_starts(terms)):
+        end = start + pd.Timedelta(days=7 * weeks - 1)
+        for course_id in range(1, courses + 1):
+            days = np.sort(rng.choice(np.arange(2, 7), rng.integers(1, 4), replace=False))
+            schedules.append({
+                'id': term * courses + course_id,
+                'course_id': course_id,
+                'lecturer_id': int(rng.integers(1, 60)),
+                'start': start,
+                'end': end,
+                'days': days,
+                'term': term,
+            })
+    write_csv(
+        os.path.join(output_dir, 'schedules.csv'),
+        ['ID', 'COURSE_ID', 'LECTURER_ID', 'START_DT', 'END_DT', 'COURSE_DAYS'],
+        ((s['id'], s['course_id'], s['lecturer_id'], s['start'].strftime(DATE_FORMAT), s['end'].strftime(DATE_FORMAT),
+          ','.join(str(day) for day in s['days'])) for s in schedules),
+        quoted_columns=(5,)
+    )
+
+    # Every student takes COURSES_PER_STUDENT courses per term
+    per_term = min(COURSES_PER_STUDENT, courses)
+    enrollments = []
+    for term in range(terms):
+        term_schedules = [s for s in schedules if s['term'] == term]
+        year, semester = divmod(term, 2)
+        academic_year = f"{2019 + year}/{2020 + year}"
+        enroll_dt = (term_schedules[0]['start'] - pd.Timedelta(days=23)).strftime(DATE_FORMAT)
+        picks = np.argsort(rng.random((students, len(term_schedules))), axis=1)[:, :per_term]
+        for student_index, schedule_indexes in enumerate(picks):
+            for schedule_index in schedule_indexes:
+                enrollments.append((student_index + 1, term_schedules[schedule_index]['id'],
+                                    academic_year, semester + 1, enroll_dt))
+    write_csv(
+        os.path.join(output_dir, 'enrollments.csv'),
+        ['ID', 'STUDENT_ID', 'SCHEDULE_ID', 'ACADEMIC_YEAR', 'SEMESTER', 'ENROLL_DT'],
+        ((enrollment_id, *enrollment) for enrollment_id, enrollment in enumerate(enrollments, start=1))
+    )
+
+    # Session dates of every schedule, weekday numbering as in Transformer (Monday = 2)
+    session_dates = {}
+    for s in schedules:
+        dates = pd.date_range(s['start'], s['end'])
+        session_dates[s['id']] = dates[np.isin(dates.weekday + 2, s['days'])].strftime(DATE_FORMAT).to_numpy()
+
+    # Attendance is drawn per (enrollment, session), one schedule at a time, and written in chunks
+    attendance_path = os.path.join(output_dir, 'attendances.csv')
+    with open(attendance_path, 'w', newline='') as file:
+        file.write('ID,STUDENT_ID,SCHEDULE_ID,ATTEND_DT\r\n')
+    enrolled = pd.DataFrame(enrollments, columns=['student_id', 'schedule_id', 'academic_year', 'semester', 'enroll_dt'])
+    next_id = 1
+    buffer = []
+    buffered_rows = 0
+    for schedule_id, group in enrolled.groupby('schedule_id', sort=True):
+        dates = session_dates[schedule_id]
+        student_ids = group['student_id'].to_numpy()
+        attended = rng.random((len(student_ids), len(dates))) < attendance_rate
+        student_index, date_index = np.nonzero(attended)
+        buffer.append(pd.DataFrame({
+            'STUDENT_ID': student_ids[student_index],
+            'SCHEDULE_ID': schedule_id,
+            'ATTEND_DT': dates[date_index],
+        }))
+        buffered_rows += len(student_index)
+        if buffered_rows >= ATTENDANCE_CHUNK_ROWS:
+            next_id = flush_attendances(attendance_path, buffer, next_id)
+            buffer, buffered_rows = [], 0
+    next_id = flush_attendances(attendance_path, buffer, next_id)
+
+    return {
+        'courses': courses,
+        'schedules': len(schedules),
+        'enrollments': len(enrollments),
+        'attendances': next_id - 1,
+    }
+
+def flush_attendances(path, frames, next_id):
+    """Append buffered attendance rows with consecutive IDs, returns the next free ID"""
+    if not frames:
+        return next_id
+    df = pd.concat(frames, ignore_index=True)
+    df.insert(0, 'ID', np.arange(next_id, next_id + len(df)))
+    df.to_csv(path, mode='a', header=False, index=False, lineterminator='\r\n')
+    return next_id + len(df)
+
+def students_for_rows(target_rows, courses=10, weeks=13, terms=2, attendance_rate=0.8):
+    """Number of students that gives roughly target_rows attendance rows"""
+    sessions_per_course = weeks * 2
+    rows_per_student = min(COURSES_PER_STUDENT, courses) * terms * sessions_per_course * attendance_rate
+    return max(1, int(round(target_rows / rows_per_student)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output_dir')
+    parser.add_argument('--students', type=int, default=100)
+    parser.add_argument('--courses', type=int, default=10)
+    parser.add_argument('--weeks', type=int, default=13)
+    parser.add_argument('--terms', type=int, default=2)
+    parser.add_argument('--attendance-rate', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    counts = generate(args.output_dir, args.students, args.courses, args.weeks, args.terms,
+                      args.attendance_rate, args.seed)
+    print(', '.join(f"{count} {name}" for name, count in counts.items()) + f" written to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
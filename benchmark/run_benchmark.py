@@ -0,0 +1,160 @@
+"""End-to-end scaling benchmark of the Extractor, Transformer and Loader against a local PostgreSQL
+
+Every scale is a target number of attendance rows. The source files are generated with
+generate_data.py, then each stage runs in its own process so its peak memory can be measured.
+Run it against a dedicated database: --reset drops the pipeline tables before every scale.
+
+Usage: DB_HOST=localhost DB_SCHEMA=university_bench python benchmark/run_benchmark.py --reset [10000 1000000 10000000]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from datetime import datetime
+from queue import Empty
+
+REPO_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_PATH)
+
+from config import Config
+from db import Database
+from extract import Extractor
+from transform import Transformer
+from load import Loader
+from generate_data import generate, students_for_rows
+
+STAGES = (
+    ('extract', Extractor, ('stg__courses', 'stg__schedules', 'stg__enrollments', 'stg__attendances')),
+    ('transform', Transformer, ('wh__courses', 'wh__schedules', 'wh__enrollments', 'wh__attendances')),
+    ('load', Loader, ('mart__weekly_attendance',)),
+)
+
+def run_stage(stage_class, source_path, results):
+    """Child process body: run one stage and report its wall time and peak RSS"""
+    Config.SOURCE_PATH = source_path
+    start_time = time.perf_counter()
+    stage = stage_class()
+    stage.run()
+    seconds = time.perf_counter() - start_time
+    Database.close()
+    # ru_maxrss is in kilobytes on Linux, errors are the ones the stage caught and rolled back
+    results.put({'seconds': seconds, 'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                 'errors': stage.errors})
+
+def wait_for_stage(process, results):
+    """Result reported by a stage process, None when the process exited without reporting one"""
+    while True:
+        try:
+            return results.get(timeout=1)
+        except Empty:
+            if process.exitcode is not None:
+                # A result put right before the exit can still be on its way
+                try:
+                    return results.get(timeout=1)
+                except Empty:
+                    return None
+
+def count_rows(tables):
+    with Database.get().session() as connection:
+        with connection.cursor() as cursor:
+            total = 0
+            for table in tables:
+                cursor.execute(f"SELECT COUNT(*) FROM {table}")
+                total += cursor.fetchone()[0]
+    return total
+
+def reset_tables():
+    """Drop every table created by the pipeline"""
+    with Database.get().session() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT 'DROP ' || CASE WHEN c.relkind = 'm' THEN 'MATERIALIZED VIEW' ELSE 'TABLE' END
+                    || ' IF EXISTS ' || quote_ident(c.relname) || ' CASCADE'
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = current_schema()
+                    AND c.relkind IN ('r', 'p', 'm')
+                    AND NOT c.relispartition
+                    AND c.relname ~ '^(stg|wh|mart|pipeline)__'
+            """)
+            for (statement,) in cursor.fetchall():
+                cursor.execute(statement)
+        connection.commit()
+
+def benchmark_scale(target_rows, data_path, reset):
+    """Generate the data for one scale and time every stage on it"""
+    source_path = os.path.join(data_path, str(target_rows))
+    if not os.path.exists(os.path.join(source_path, 'attendances.csv')):
+        counts = generate(source_path, students=students_for_rows(target_rows))
+        print(f"Generated {counts} into {source_path}")
+    if reset:
+        reset_tables()
+
+    source_rows = sum(
+        sum(1 for _ in open(os.path.join(source_path, file_name))) - 1
+        for file_name in os.listdir(source_path) if file_name.endswith('.csv')
+    )
+    result = {'target_rows': target_rows, 'source_rows': source_rows, 'stages': {}}
+
+    context = multiprocessing.get_context('fork')
+    for name, stage_class, output_tables in STAGES:
+        # Forked children must not share the parent's pooled connections
+        Database.close()
+        queue = context.Queue()
+        process = context.Process(target=run_stage, args=(stage_class, source_path, queue))
+        process.start()
+        stage = wait_for_stage(process, queue)
+        process.join()
+        if stage is None:
+            # The next stages read what this one should have written
+            print(f"The {name} stage exited with code {process.exitcode}, skipping the rest of {target_rows} rows.")
+            result['stages'][name] = {'status': 'failed', 'exitcode': process.exitcode}
+            break
+        if stage['errors']:
+            print(f"The {name} stage failed ({stage['errors']}), skipping the rest of {target_rows} rows.")
+            result['stages'][name] = {'status': 'failed', 'errors': stage['errors']}
+            break
+
+        stage['status'] = 'finished'
+        stage['rows_out'] = count_rows(output_tables)
+        stage['rows_per_second'] = round(stage['rows_out'] / stage['seconds'], 1) if stage['seconds'] else None
+        stage['seconds'] = round(stage['seconds'], 3)
+        stage['peak_rss_mb'] = round(stage['peak_rss_mb'], 1)
+        result['stages'][name] = stage
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scales', nargs='*', type=int, default=[10_000, 1_000_000, 10_000_000])
+    parser.add_argument('--data-path', default=os.path.join(REPO_PATH, 'benchmark', 'data'))
+    parser.add_argument('--results-path', default=os.path.join(REPO_PATH, 'benchmark', 'results'))
+    parser.add_argument('--reset', action='store_true', help="drop the pipeline tables before every scale")
+    args = parser.parse_args()
+
+    # Stages read their DDL files relative to the repository root
+    os.chdir(REPO_PATH)
+    results = [benchmark_scale(target_rows, args.data_path, args.reset) for target_rows in args.scales]
+    Database.close()
+
+    print(f"{'rows':>10} {'stage':<10} {'seconds':>9} {'rows out':>10} {'rows/s':>12} {'peak MB':>8}")
+    for result in results:
+        for name, stage in result['stages'].items():
+            if stage['status'] == 'failed':
+                reason = f"exit code {stage['exitcode']}" if 'exitcode' in stage else ', '.join(stage['errors'])
+                print(f"{result['target_rows']:>10} {name:<10} {'failed':>9} ({reason})")
+                continue
+            print(f"{result['target_rows']:>10} {name:<10} {stage['seconds']:>9.2f} {stage['rows_out']:>10} "
+                  f"{stage['rows_per_second'] or 0:>12,.0f} {stage['peak_rss_mb']:>8.1f}")
+
+    os.makedirs(args.results_path, exist_ok=True)
+    results_file = os.path.join(args.results_path, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(results_file, 'w') as file:
+        json.dump({'config': {name: getattr(Config, name) for name in dir(Config) if name.isupper() and 'PASSWORD' not in name},
+                   'results': results}, file, indent=2, default=str)
+    print(f"Results saved to {results_file}")
+
+if __name__ == "__main__":
+    main()
@@ -8,4 +8,69 @@ class Config:
     DB_PORT = os.getenv('DB_PORT', '5432')
     DB_SCHEMA = os.getenv('DB_SCHEMA', 'university_db')
     DB_USER = os.getenv('DB_USER', 'dataengineer')
-    DB_PASSWORD = os.getenv('DB_PASSWORD', 'secret')
\ No newline at end of file
+    DB_PASSWORD = os.getenv('DB_PASSWORD', 'secret')
+
+    # Connection pool shared by all stages, and session settings of every pooled connection
+    # (an empty value keeps the server default)
+    DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+    DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '8'))
+    DB_SYNCHRONOUS_COMMIT = os.getenv('DB_SYNCHRONOUS_COMMIT', '')
+    DB_WORK_MEM = os.getenv('DB_WORK_MEM', '')
+    DB_STATEMENT_TIMEOUT = os.getenv('DB_STATEMENT_TIMEOUT', '')
+
+    # Incremental runs skip unchanged source files and only transform staging rows above the
+    # last processed ID of each table
+    INCREMENTAL = os.getenv('INCREMENTAL', 'true').lower() == 'true'
+    # Continue unfinished loads from their last committed chunk in pipeline__checkpoints (main.py --resume)
+    RESUME = os.getenv('RESUME', 'false').lower() == 'true'
+
+    # Extract settings ('copy' streams files with COPY FROM STDIN, 'stream' loads and commits
+    # CSV_CHUNK_SIZE rows at a time, 'row' inserts row by row)
+    INGEST_MODE = os.getenv('INGEST_MODE', 'copy')
+    CSV_CHUNK_SIZE = int(os.getenv('CSV_CHUNK_SIZE', '100000'))
+    # More than one worker ingests the source files concurrently, one connection per worker
+    EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', '1'))
+    # Chunks of CSV_CHUNK_SIZE rows waiting between two stages of the streaming mode (main.py --mode streaming)
+    STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '4'))
+    # Directory polled by the watch mode (main.py --mode watch, SOURCE_PATH when empty) and seconds between polls
+    WATCH_PATH = os.getenv('WATCH_PATH', '')
+    WATCH_INTERVAL = float(os.getenv('WATCH_INTERVAL', '5'))
+
+
+    # Transform settings ('batch' reads whole staging tables, 'stream' reads TRANSFORM_CHUNK_SIZE rows
+    # at a time through a server-side cursor)
+    TRANSFORM_MODE = os.getenv('TRANSFORM_MODE', 'batch')
+    TRANSFORM_CHUNK_SIZE = int(os.getenv('TRANSFORM_CHUNK_SIZE', '50000'))
+    # Tables transformed inside PostgreSQL with a single INSERT ... SELECT instead of pandas, a comma
+    # separated list of source names (e.g. 'schedules,attendances') or 'all'
+    PUSHDOWN_TABLES = [table.strip() for table in os.getenv('PUSHDOWN_TABLES', '').split(',') if table.strip()]
+    WH_BATCH_SIZE = int(os.getenv('WH_BATCH_SIZE', '5000'))
+    # 'nothing' keeps rows that are already in the warehouse, 'update' overwrites them
+    WH_CONFLICT_ACTION = os.getenv('WH_CONFLICT_ACTION', 'nothing')
+    # Range partitions of wh__schedules and wh__attendances ('month' or 'semester')
+    WH_PARTITION_INTERVAL = os.getenv('WH_PARTITION_INTERVAL', 'month')
+    # First month of each semester, semester 1 starts in August and semester 2 in January
+    SEMESTER_START_MONTHS = [int(month) for month in os.getenv('SEMESTER_START_MONTHS', '8,1').split(',')]
+
+    # Load settings ('incremental' recomputes only the mart rows touched by new warehouse rows,
+    # 'full' rebuilds the whole mart table)
+    MART_REFRESH = os.getenv('MART_REFRESH', 'incremental')
+    # Capture EXPLAIN (ANALYZE, BUFFERS) of the report query into PLAN_PATH on every load
+    EXPLAIN_REPORT = os.getenv('EXPLAIN_REPORT', 'false').lower() == 'true'
+    PLAN_PATH = os.getenv('PLAN_PATH', 'plans/')
+    # Report file streamed from the mart with COPY TO ('csv', 'csv.gz' or 'parquet'), REPORT_PATH is the
+    # file name without extension, REPORT_SPLIT_BY writes one file per 'semester' or 'course'
+    REPORT_FORMAT = os.getenv('REPORT_FORMAT', 'csv')
+    REPORT_PATH = os.getenv('REPORT_PATH', 'weekly_attendance_report')
+    REPORT_SPLIT_BY = os.getenv('REPORT_SPLIT_BY', '')
+
+    # Directory of the JSON run reports written by main.py
+    METRICS_PATH = os.getenv('METRICS_PATH', 'metrics/')
+    # Jobs of a runner.py manifest running at the same time, each in its own process with its own connection pool
+    RUNNER_WORKERS = int(os.getenv('RUNNER_WORKERS', '2'))
+
+    # Parquet snapshots of the parsed source files and transformed frames under SNAPSHOT_PATH/<run id>,
+    # set SNAPSHOT_RUN_ID to an earlier run to resume it from its snapshots
+    SNAPSHOT_ENABLED = os.getenv('SNAPSHOT_ENABLED', 'false').lower() == 'true'
+    SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'snapshots/')
+    SNAPSHOT_RUN_ID = os.getenv('SNAPSHOT_RUN_ID', '')
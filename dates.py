@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
+from config import Config
+
+def date_keys(values):
+    """Integer YYYYMMDD keys of dates or ISO date strings, each unique value is converted once"""
+    codes, uniques = pd.factorize(pd.Series(values))
+    parsed = pd.to_datetime(pd.Series(uniques), errors='coerce')
+    unique_keys = (parsed.dt.year * 10000 + parsed.dt.month * 100 + parsed.dt.day).to_numpy(dtype=float)
+
+    keys = np.full(len(codes), np.nan)
+    valid = codes >= 0
+    keys[valid] = unique_keys[codes[valid]]
+    if np.isnan(keys).any():
+        # Rows without a date keep a NULL key
+        return np.array([None if np.isnan(key) else int(key) for key in keys], dtype=object)
+    return keys.astype(np.int64)
+
+def semester_start(year, month):
+    """Year, month and number of the semester holding the month, semesters are numbered in SEMESTER_START_MONTHS order"""
+    starts = Config.SEMESTER_START_MONTHS
+    # A semester starts at the latest start month on or before the month, or at the last start of the previous year
+    earlier = [(start, number) for number, start in enumerate(starts, 1) if start <= month]
+    if earlier:
+        start_month, number = max(earlier)
+        return year, start_month, number
+    start_month, number = max((start, number) for number, start in enumerate(starts, 1))
+    return year - 1, start_month, number
+
+def semester_end(year, start_month):
+    """Year and month of the start of the semester following the one starting in (year, start_month)"""
+    later = sorted(start for start in Config.SEMESTER_START_MONTHS if start > start_month)
+    if later:
+        return year, later[0]
+    return year + 1, min(Config.SEMESTER_START_MONTHS)
+
+def calendar(start_date, end_date):
+    """Rows of the date dimension for every day between start_date and end_date"""
+    days = pd.date_range(start_date, end_date, freq='D')
+    df = pd.DataFrame({'calendar_date': days})
+    df['date_key'] = days.year * 10000 + days.month * 100 + days.day
+    # ISO weekday, Monday is 1
+    df['weekday'] = days.dayofweek + 1
+    # Numbering of COURSE_DAYS in the source schedules, Monday is 2
+    df['course_day'] = days.dayofweek + 2
+
+    # Semester attributes are computed once per month
+    months = pd.Series(days.to_period('M'), index=df.index)
+    semesters = {}
+    for month in months.unique():
+        year, start_month, number = semester_start(month.year, month.month)
+        first_year = month.year if month.month >= Config.SEMESTER_START_MONTHS[0] else month.year - 1
+        semesters[month] = (f"{first_year}/{first_year + 1}", number, pd.Timestamp(year=year, month=start_month, day=1))
+    df['academic_year'] = months.map(lambda month: semesters[month][0])
+    df['semester'] = months.map(lambda month: semesters[month][1])
+    df['semester_start'] = months.map(lambda month: semesters[month][2])
+    df['week_of_term'] = (df['calendar_date'] - df['semester_start']).dt.days // 7 + 1
+    return df[['date_key', 'calendar_date', 'weekday', 'course_day', 'academic_year', 'semester', 'semester_start', 'week_of_term']]
+
+class DateDimension:
+    """wh__dim_date rows covering every date the warehouse references, generated once per date"""
+
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+        self.known_keys = None
+
+    def ensure(self, keys):
+        """Generate and commit the missing dimension rows for the given date keys, returns how many were added"""
+        keys = pd.unique(pd.Series(keys).dropna().astype(np.int64))
+        if self.known_keys is None:
+            self.cursor.execute("SELECT date_key FROM wh__dim_date")
+            self.known_keys = {row[0] for row in self.cursor.fetchall()}
+        missing = [int(key) for key in keys if key not in self.known_keys]
+        if not missing:
+            return 0
+
+        # The dimension covers the whole range between the known and the new dates, without gaps
+        covered = list(self.known_keys) + missing
+        start = pd.to_datetime(str(min(covered)), format='%Y%m%d')
+        end = pd.to_datetime(str(max(covered)), format='%Y%m%d')
+        rows = calendar(start, end)
+        rows = rows[~rows['date_key'].isin(self.known_keys)]
+        execute_values(
+            self.cursor,
+            f"INSERT INTO wh__dim_date ({', '.join(rows.columns)}) VALUES %s ON CONFLICT DO NOTHING",
+            [
+                (int(row.date_key), row.calendar_date.date(), int(row.weekday), int(row.course_day), row.academic_year,
+                 int(row.semester), row.semester_start.date(), int(row.week_of_term))
+                for row in rows.itertuples(index=False)
+            ],
+            page_size=1000
+        )
+        # Dimension rows are committed on their own, so the known keys stay valid when a later write rolls back
+        self.connection.commit()
+        self.known_keys.update(int(key) for key in rows['date_key'])
+        return len(rows)
@@ -0,0 +1,150 @@
+import threading
+from contextlib import contextmanager
+from psycopg2 import Error, pool
+from config import Config
+from metrics import CountingCursor
+
+class Database:
+    """Connection pool shared by the Extractor, Transformer and Loader of a process"""
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self):
+        self.pool = pool.ThreadedConnectionPool(
+            Config.DB_POOL_MIN,
+            Config.DB_POOL_MAX,
+            host=Config.DB_HOST,
+            port=Config.DB_PORT,
+            database=Config.DB_SCHEMA,
+            user=Config.DB_USER,
+            password=Config.DB_PASSWORD,
+            options=self.session_options(),
+            cursor_factory=CountingCursor
+        )
+        # ThreadedConnectionPool raises when it is exhausted, the semaphore makes callers wait instead
+        self.available = threading.BoundedSemaphore(Config.DB_POOL_MAX)
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    @classmethod
+    def get(cls):
+        """Return the pool of this process, creating it on first use"""
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    @classmethod
+    def close(cls):
+        """Close every pooled connection of this process"""
+        with cls._instance_lock:
+            if cls._instance is not None:
+                cls._instance.pool.closeall()
+                cls._instance = None
+
+    @staticmethod
+    def session_options():
+        """Session settings applied by the server to every pooled connection at connect time"""
+        settings = {
+            'synchronous_commit': Config.DB_SYNCHRONOUS_COMMIT,
+            'work_mem': Config.DB_WORK_MEM,
+            'statement_timeout': Config.DB_STATEMENT_TIMEOUT,
+        }
+        return ' '.join(f"-c {name}={value}" for name, value in settings.items() if value)
+
+    def get_connection(self):
+        """Check a connection out of the pool, waiting when all of them are in use"""
+        self.available.acquire()
+        try:
+            connection = self.pool.getconn()
+        except Exception:
+            self.available.release()
+            raise
+        with self.lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return connection
+
+    def release(self, connection):
+        """Return a connection to the pool, an open transaction is rolled back by the pool"""
+        self.pool.putconn(connection)
+        with self.lock:
+            self.in_use -= 1
+        self.available.release()
+
+    @contextmanager
+    def session(self):
+        """Connection checked out for the duration of a with block"""
+        connection = self.get_connection()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def stats(self):
+        """Pool usage statistics"""
+        with self.lock:
+            return {
+                'min_connections': Config.DB_POOL_MIN,
+                'max_connections': Config.DB_POOL_MAX,
+                'checkouts': self.checkouts,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+            }
+
+
+class PooledStage:
+    """Pooled connection, cursor and caught errors shared by the Extractor, Transformer and Loader"""
+
+    def __init__(self):
+        self.connection = None
+        self.cursor = None
+        self.errors = {}
+        self.connect_to_db()
+
+    def connect_to_db(self):
+        """Check a connection to the PostgreSQL database out of the shared pool"""
+        try:
+            self.connection = Database.get().get_connection()
+            self.cursor = self.connection.cursor()
+            print("Database connection established.")
+
+        except(Exception, Error) as error:
+            print(f"Error while connecting to PostgreSQL: {error}")
+            self.errors['connect'] = str(error)
+            self.connection = None
+            self.cursor = None
+
+    def close_db(self):
+        """Close the cursor and return the connection to the pool"""
+        if self.cursor:
+            self.cursor.close()
+            self.cursor = None
+        if self.connection:
+            Database.get().release(self.connection)
+            self.connection = None
+            print("PostgreSQL connection is returned to the pool.")
+
+    def execute_ddl_from_file(self, file_path):
+        """Execute DDL statements from a file"""
+        if not self.connection or not self.cursor:
+            print("No database connection available.")
+            return
+
+        try:
+            with open(file_path, 'r') as file:
+                ddl_statements = file.read().split(';')
+            
+            for statement in ddl_statements:
+                if statement.strip():
+                    self.cursor.execute(statement)
+                    self.connection.commit()
+            print("DDL statements executed successfully.")
+
+        except (Exception, Error) as error:
+            print(f"Error while executing DDL statements: {error}")
+            self.errors['ddl'] = str(error)
+            self.connection.rollback()
@@ -1,62 +1,23 @@
 import pandas as pd
-import psycopg2
 from psycopg2 import Error
 from config import Config
+from db import PooledStage
+from state import PipelineState
+from metrics import metrics
+from snapshot import SnapshotStore
+from schemas import SchemaError, schema_for, source_of_file
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
+import io
 import os
+import time
 
-class Extractor:
+class Extractor(PooledStage):
     def __init__(self):
-        self.connection = None
-        self.cursor = None
-        self.connect_to_db()
+        super().__init__()
+        self.state = PipelineState(self.connection, self.cursor)
         print("Starting extraction...")
     
-    def connect_to_db(self):
-        """Establish a connection to the PostgreSQL database"""
-        try:
-            self.connection = psycopg2.connect(
-                host=Config.DB_HOST,
-                port=Config.DB_PORT,
-                database=Config.DB_SCHEMA,
-                user=Config.DB_USER,
-                password=Config.DB_PASSWORD
-            )
-            self.cursor = self.connection.cursor()
-            print("Database connection established.")
-
-        except(Exception, Error) as error:
-            print(f"Error while connecting to PostgreSQL: {error}")
-            self.connection = None
-            self.cursor = None
-
-    def close_db(self):
-        """Close the database connection and cursor"""
-        if self.cursor:
-            self.cursor.close()
-        if self.connection:
-            self.connection.close()
-            print("PostgreSQL connection is closed.")
-
-    def execute_ddl_from_file(self, file_path):
-        """Execute DDL statements from a file"""
-        if not self.connection or not self.cursor:
-            print("No database connection available.")
-            return
-
-        try:
-            with open(file_path, 'r') as file:
-                ddl_statements = file.read().split(';')
-            
-            for statement in ddl_statements:
-                if statement.strip():
-                    self.cursor.execute(statement)
-                    self.connection.commit()
-            print("DDL statements executed successfully.")
-
-        except (Exception, Error) as error:
-            print(f"Error while executing DDL statements: {error}")
-            self.connection.rollback()       
-        
     def ingest_csv_to_table(self, csv_file, table_name):
         """Read CSV file and insert data into the PostgreSQL table"""
         if not self.connection or not self.cursor:
@@ -64,12 +25,16 @@ class Extractor:
             return
         
         try:
-            # Read the CSV file to a dataframe
-            df = pd.read_csv(csv_file)
+            # Read the CSV file to a dataframe, dates stay text in the staging layer
+            df = schema_for(table_name).read_csv(csv_file, parse_dates=False)
+            metrics.record(rows_in=len(df))
+
+            inserted_rows = 0
+            inserted = []
 
             # Check if the ID already exist in the table
-            for row in df.itertuples(index=False):
-                id_value = row.ID
+            for position, row in enumerate(df.itertuples(index=False)):
+                id_value = row.id
 
                 # Check whether ID is already exist in the table or not
                 self.cursor.execute(f"SELECT 1 FROM {table_name} WHERE id = %s;", (id_value,))
@@ -82,26 +47,320 @@ class Extractor:
                     insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values})"
 
                     self.cursor.execute(insert_query, row)
+                    inserted_rows += 1
+                    inserted.append(position)
 
             self.connection.commit()
+            self.snapshot_rows(table_name, df.iloc[inserted])
             print(f"Data from {csv_file} inserted into {table_name} successfully.")
+            return inserted_rows
+
+        except (Exception, Error) as error:
+            print(f"Error while inserting data from {csv_file}: {error}")
+            self.errors[csv_file] = str(error)
+            self.connection.rollback()
+
+    def bulk_ingest_csv_to_table(self, csv_file, table_name):
+        """Stream CSV file into a temporary table with COPY, then merge the new IDs into the PostgreSQL table"""
+        if not self.connection or not self.cursor:
+            print("No database connection available.")
+            return
+
+        try:
+            start_time = time.perf_counter()
+            temp_table = f"tmp__{table_name}"
+
+            columns = schema_for(table_name).read_header(csv_file)
+            with open(csv_file, 'r', newline='') as file:
+                copied_rows = self.copy_to_temp_table(file, temp_table, table_name, columns, header=True)
+
+            # With snapshots the new rows come back to be written to the bronze snapshot
+            if SnapshotStore.get():
+                new_rows = self.merge_new_rows(temp_table, table_name, columns, returning=True)
+                inserted_rows = len(new_rows)
+            else:
+                new_rows = None
+                inserted_rows = self.merge_new_rows(temp_table, table_name, columns)
+            self.connection.commit()
+            self.snapshot_rows(table_name, new_rows)
+
+            elapsed = time.perf_counter() - start_time
+            rows_per_second = copied_rows / elapsed if elapsed > 0 else 0
+            metrics.record(rows_in=copied_rows)
+            print(f"Data from {csv_file} inserted into {table_name} successfully "
+                  f"({inserted_rows} new of {copied_rows} rows, {rows_per_second:,.0f} rows/s).")
+            return inserted_rows
 
         except (Exception, Error) as error:
             print(f"Error while inserting data from {csv_file}: {error}")
+            self.errors[csv_file] = str(error)
             self.connection.rollback()
 
+    def stream_csv_to_table(self, csv_file, table_name, checkpoint=None):
+        """Read CSV file in fixed-size chunks, merging and committing every chunk with its checkpoint before reading
+        the next one, a resumed file starts at the byte offset of its checkpoint"""
+        if not self.connection or not self.cursor:
+            print("No database connection available.")
+            return
+
+        try:
+            start_time = time.perf_counter()
+            source_version = self.source_version(csv_file)
+            committed_rows, _, byte_offset = checkpoint if checkpoint else (0, 0, 0)
+            copied_rows = 0
+            inserted_rows = 0
+            if byte_offset:
+                print(f"Resuming {csv_file} after {committed_rows} committed rows.")
+
+            returning = SnapshotStore.get() is not None
+            for chunk, end_offset in self.read_chunks(csv_file, table_name, byte_offset):
+                chunk_copied, new_rows = self.stage_chunk(chunk, table_name, returning)
+                copied_rows += chunk_copied
+                inserted_rows += len(new_rows) if returning else new_rows
+                committed_rows += len(chunk)
+                self.state.save_checkpoint(csv_file, table_name, source_version, committed_rows, byte_offset=end_offset)
+                self.connection.commit()
+                if returning:
+                    self.snapshot_rows(table_name, new_rows)
+            self.state.clear_checkpoint(csv_file, table_name)
+            self.connection.commit()
+
+            elapsed = time.perf_counter() - start_time
+            rows_per_second = copied_rows / elapsed if elapsed > 0 else 0
+            metrics.record(rows_in=copied_rows)
+            print(f"Data from {csv_file} inserted into {table_name} successfully "
+                  f"({inserted_rows} new of {copied_rows} rows, {rows_per_second:,.0f} rows/s).")
+            return inserted_rows
+
+        except (Exception, Error) as error:
+            print(f"Error while inserting data from {csv_file}: {error}")
+            self.errors[csv_file] = str(error)
+            self.connection.rollback()
+
+    def read_chunks(self, csv_file, table_name, byte_offset=0):
+        """Chunks of CSV_CHUNK_SIZE lines of a source file from byte_offset on, parsed with its schema, each with
+        the byte offset after its last record"""
+        schema = schema_for(table_name)
+        columns = schema.read_header(csv_file)
+        with open(csv_file, 'rb') as file:
+            if byte_offset:
+                file.seek(byte_offset)
+            else:
+                file.readline()
+            while True:
+                lines = list(islice(file, Config.CSV_CHUNK_SIZE))
+                if not lines:
+                    break
+                # A newline inside a quoted field does not end a record, the chunk runs on to the end of the record
+                quotes = sum(line.count(b'"') for line in lines)
+                while quotes % 2:
+                    line = file.readline()
+                    if not line:
+                        break
+                    lines.append(line)
+                    quotes += line.count(b'"')
+                # Chunks use the compact schema dtypes, dates stay text in the staging layer
+                chunk = schema.read_csv(io.BytesIO(b''.join(lines)), parse_dates=False, columns=columns)
+                yield chunk, file.tell()
+
+    @staticmethod
+    def source_version(csv_file):
+        """Size and modification time of a source file, a checkpoint only applies to the same version"""
+        stat = os.stat(csv_file)
+        return f"{stat.st_size}:{stat.st_mtime}"
+
+    def resume_checkpoint(self, csv_file, table_name):
+        """Checkpoint to continue the file from when the run resumes, None otherwise"""
+        if not Config.RESUME:
+            return None
+        return self.state.get_checkpoint(csv_file, table_name, self.source_version(csv_file))
+
+    def stage_chunk(self, chunk, table_name, returning=False):
+        """COPY a frame of source rows into the staging table without committing, returns the copied rows and
+        the number of new rows, or the new rows themselves with returning"""
+        temp_table = f"tmp__{table_name}"
+        columns = list(chunk.columns)
+        buffer = io.StringIO()
+        # IDs are floats only when some of them are NULL, written back as integers
+        chunk.to_csv(buffer, index=False, header=False, float_format='%.0f')
+        buffer.seek(0)
+
+        copied_rows = self.copy_to_temp_table(buffer, temp_table, table_name, columns, header=False)
+        return copied_rows, self.merge_new_rows(temp_table, table_name, columns, returning)
+
+    def copy_to_temp_table(self, file, temp_table, table_name, columns, header):
+        """COPY CSV content into a temporary table shaped like the staging table, dropped on commit"""
+        self.cursor.execute(f"CREATE TEMP TABLE {temp_table} (LIKE {table_name}) ON COMMIT DROP")
+        self.cursor.copy_expert(
+            f"COPY {temp_table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, HEADER {str(header).lower()})",
+            file
+        )
+        return self.cursor.rowcount
+
+    def merge_new_rows(self, source_table, table_name, columns, returning=False):
+        """Insert rows whose ID does not exist in the table yet in one set-based statement, returns their number
+        or, with returning, the inserted rows as a dataframe"""
+        column_list = ', '.join(columns)
+        self.cursor.execute(f"""
+            INSERT INTO {table_name} ({column_list})
+            SELECT DISTINCT ON (src.id) {', '.join(f'src.{column}' for column in columns)}
+            FROM {source_table} AS src
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table_name} AS tgt WHERE tgt.id = src.id
+            )
+            -- The source table is freshly filled in file order, so the first row of a duplicated ID wins
+            ORDER BY src.id, src.ctid
+            {f'RETURNING {column_list}' if returning else ''}
+        """)
+        if returning:
+            return pd.DataFrame(self.cursor.fetchall(), columns=columns)
+        return self.cursor.rowcount
+
+    def ingest_file(self, file_path, table_name):
+        """Ingest one source file with the configured ingest mode, returns the number of new rows or None on failure"""
+        # A file with a checkpoint is continued in chunks whatever the ingest mode
+        checkpoint = self.resume_checkpoint(file_path, table_name)
+        if checkpoint or Config.INGEST_MODE == 'stream':
+            inserted_rows = self.stream_csv_to_table(file_path, table_name, checkpoint)
+        elif Config.INGEST_MODE == 'copy':
+            inserted_rows = self.bulk_ingest_csv_to_table(file_path, table_name)
+        else:
+            inserted_rows = self.ingest_csv_to_table(file_path, table_name)
+
+        return inserted_rows
+
+    def snapshot_rows(self, table_name, new_rows):
+        """Add the rows just merged into a staging table to its bronze snapshot, so the snapshot holds the same
+        values as staging"""
+        snapshots = SnapshotStore.get()
+        if not snapshots or new_rows is None or new_rows.empty:
+            return
+        try:
+            # New staging rows replace the frames transformed without them
+            snapshots.clear('silver', f"wh_{table_name[4:]}")
+            snapshots.write('bronze', table_name, schema_for(table_name).compact(new_rows, parse_dates=False))
+            metrics.record(snapshot_rows=len(new_rows))
+            print(f"Bronze snapshot of {table_name} extended ({len(new_rows)} rows).")
+
+        except (Exception, Error) as error:
+            # The snapshot is an optional copy, the transform falls back to the staging table without it
+            print(f"Error while writing the snapshot of {table_name}: {error}")
+            snapshots.clear('bronze', table_name)
+
+    def process_csv_file(self, file_path, table_name):
+        """Ingest a source file, skipping it when incremental runs find it unchanged"""
+        with metrics.step('extract.file', table=table_name, file=file_path):
+            if Config.INCREMENTAL:
+                inserted_rows = self.ingest_changed_file(file_path, table_name)
+            else:
+                inserted_rows = self.ingest_file(file_path, table_name)
+            metrics.record(rows_out=inserted_rows)
+        return inserted_rows
+
+    def ingest_changed_file(self, file_path, table_name):
+        """Ingest a source file unless its fingerprint matches the last successful ingest"""
+        changed, fingerprint = self.state.check_file(file_path)
+        if not changed:
+            print(f"Skipping {file_path}, unchanged since the last run.")
+            metrics.record(skipped=True)
+            inserted_rows = 0
+        else:
+            inserted_rows = self.ingest_file(file_path, table_name)
+            if inserted_rows is None:
+                return None
+        self.state.record_file(file_path, fingerprint)
+        self.connection.commit()
+        return inserted_rows
+
+    def process_csv_files_on_new_connection(self, csv_files):
+        """Ingest source files one after the other on a dedicated connection, returns the errors per file"""
+        worker = Extractor()
+        try:
+            for file_path, table_name in csv_files:
+                worker.process_csv_file(file_path, table_name)
+            return worker.errors
+        finally:
+            worker.close_db()
+
+    def list_csv_files(self, source_path=None):
+        """Source CSV files with their staging table names, in file name order
+
+        Every file whose name starts with a source name goes to the staging table of that source, so dated files
+        like attendances_20241017.csv load into stg__attendances oldest first.
+        """
+        source_path = source_path or Config.SOURCE_PATH
+        csv_files = []
+        for file_name in sorted(os.listdir(source_path)):
+            if file_name.endswith('.csv'):
+                file_path = os.path.join(source_path, file_name)
+                try:
+                    source = source_of_file(file_name)
+                except SchemaError:
+                    # The schema check reports files without a declared source
+                    source = os.path.splitext(file_name)[0]
+                csv_files.append((file_path, f"stg__{source}"))
+        return csv_files
+
+    def validate_source_files(self):
+        """Check the columns of every source file against its declared schema, returns whether all of them match"""
+        valid = True
+        for file_path, table_name in self.list_csv_files():
+            try:
+                schema_for(table_name).read_header(file_path)
+            except (SchemaError, OSError) as error:
+                print(f"Invalid source file {file_path}: {error}")
+                self.errors[file_path] = str(error)
+                valid = False
+        return valid
+
     def process_all_csv_files(self):
         """Process all CSV files in the source directory"""
-        for file_name in os.listdir(Config.SOURCE_PATH):
-            if file_name.endswith('.csv'):
-                file_path = os.path.join(Config.SOURCE_PATH, file_name)
-                table_name = f"stg__{os.path.splitext(file_name)[0]}"
-                self.ingest_csv_to_table(file_path, table_name)
-        
-    
+        if Config.EXTRACT_WORKERS > 1:
+            self.process_all_csv_files_parallel()
+            return
+
+        for file_path, table_name in self.list_csv_files():
+            self.process_csv_file(file_path, table_name)
+
+    def process_all_csv_files_parallel(self):
+        """Process the CSV files concurrently, each worker on its own connection, collecting errors per file"""
+        csv_files = self.list_csv_files()
+        start_time = time.perf_counter()
+
+        # This extractor keeps one pooled connection, the workers share the rest
+        workers = max(1, min(Config.EXTRACT_WORKERS, Config.DB_POOL_MAX - 1))
+        # The files of one staging table are merged by the same worker, in file order
+        files_by_table = {}
+        for file_path, table_name in csv_files:
+            files_by_table.setdefault(table_name, []).append((file_path, table_name))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(self.process_csv_files_on_new_connection, table_files): table_files
+                for table_files in files_by_table.values()
+            }
+            for future in as_completed(futures):
+                try:
+                    self.errors.update(future.result())
+                except (Exception, Error) as exception:
+                    for file_path, _ in futures[future]:
+                        self.errors[file_path] = str(exception)
+
+        elapsed = time.perf_counter() - start_time
+        print(f"Extracted {len(csv_files)} files with {workers} workers in {elapsed:.2f}s, "
+              f"{len(self.errors)} failed.")
+        for file_path, error in self.errors.items():
+            print(f"  {file_path}: {error}")
+
     def run(self):
+        # Source files are validated before anything is written to the database
+        if not self.validate_source_files():
+            self.close_db()
+            print("Extract process is stopped, the source files do not match their schemas.")
+            print("------------------------------------------")
+            return
         ddl_file_path = 'stg_ddl.sql'
         self.execute_ddl_from_file(ddl_file_path)
+        self.state.create_tables()
         self.process_all_csv_files()
         self.close_db()
         print("Extract process is finished.")
@@ -1,162 +1,322 @@
 import pandas as pd
-import psycopg2
 from psycopg2 import Error
+from datetime import datetime
+import json
+import os
 from config import Config
+from db import PooledStage
+from state import PipelineState
+from metrics import metrics
+from report import report_path, report_sink
 
-class Loader:
+# Warehouse tables whose new rows can change mart rows
+MART_SOURCE_TABLES = ('wh__courses', 'wh__schedules', 'wh__enrollments', 'wh__attendances')
+
+# Percentages as text in CSV reports, the same text as the float values pandas wrote (100.0, 83.33)
+PERCENTAGE_TEXT = """
+    CASE WHEN attendance_percentage = trunc(attendance_percentage)
+        THEN trunc(attendance_percentage)::text || '.0'
+        ELSE attendance_percentage::float8::text
+    END"""
+
+# Mart column of each REPORT_SPLIT_BY value
+REPORT_SPLIT_COLUMNS = {'semester': 'semester', 'course': 'course_id'}
+
+class Loader(PooledStage):
     def __init__(self):
-        self.connection = None
-        self.cursor = None
-        self.connect_to_db()
+        self.timings = {}
+        super().__init__()
+        self.state = PipelineState(self.connection, self.cursor)
         print("Starting load process...")
 
-    def connect_to_db(self):
-        """Establish a connection to the PostgreSQL database"""
-        try:
-            self.connection = psycopg2.connect(
-                host=Config.DB_HOST,
-                port=Config.DB_PORT,
-                database=Config.DB_SCHEMA,
-                user=Config.DB_USER,
-                password=Config.DB_PASSWORD
-            )
-            self.cursor = self.connection.cursor()
-            print("Database connection established.")
+    def build_report_query(self, touched_keys_table=None):
+        """Weekly attendance query over the session facts, optionally limited to the keys in touched_keys_table
 
-        except(Exception, Error) as error:
-            print(f"Error while connecting to PostgreSQL: {error}")
-            self.connection = None
-            self.cursor = None
-
-    def close_db(self):
-        """Close the database connection and cursor"""
-        if self.cursor:
-            self.cursor.close()
-        if self.connection:
-            self.connection.close()
-            print("PostgreSQL connection is closed.")
+        The limited query takes date_from and date_to date key parameters, which bound the scan of
+        the session facts to the weeks it recomputes.
+        """
+        fact_filter = ""
+        if touched_keys_table:
+            fact_filter = f"""
+            WHERE f.schedule_date_key BETWEEN %(date_from)s AND %(date_to)s
+                AND EXISTS (
+                    SELECT 1 FROM {touched_keys_table} AS k
+                    WHERE k.course_id = f.course_id
+                        AND k.semester IS NOT DISTINCT FROM f.semester
+                        AND k.week_number = f.week_number
+                )"""
 
-    def fetch_data(self):
-        """Fetch data from the datawarehouse tables"""
-        try:
-            query = """
-            WITH schedule_sum AS (
-                SELECT
-                    course_id,
-                    schedule_date,
-                    week_number,
-                    CASE
-                        WHEN schedule_date < '2019-12-31' THEN 1
-                        WHEN schedule_date > '2020-01-01' THEN 2
-                    END AS semester
-                FROM wh__schedules
-            ),
-            attendance_sum AS (
-                SELECT
-                    schedule_id,
-                    attend_dt,
-                    COUNT(student_id) AS student_atd
-                FROM wh__attendances
-                GROUP BY schedule_id, attend_dt
-            ),
-            enrollment_num AS (
-                SELECT
-                    schedule_id,
-                    COUNT(student_id) AS student_enr
-                FROM wh__enrollments
-                GROUP BY schedule_id
-            ),
-            attendance_pct AS (
-                SELECT
-                    s.course_id,
-                    s.schedule_date,
-                    s.week_number,
-                    s.semester,
-                    COALESCE(a.student_atd, 0) AS student_attend,
-                    COALESCE(e.student_enr, 0) AS student_enrolled
-                FROM schedule_sum AS s
-                LEFT JOIN attendance_sum AS a
-                    ON s.course_id = a.schedule_id
-                    AND s.schedule_date = a.attend_dt
-                LEFT JOIN enrollment_num AS e
-                    ON s.course_id = e.schedule_id
-            )
+        return f"""
             SELECT
+                f.course_id,
                 c.name AS course_name,
-                p.semester,
-                p.week_number,
-                ROUND((SUM(p.student_attend) / NULLIF(SUM(p.student_enrolled), 0) * 100), 2) AS attendance_percentage
-            FROM attendance_pct AS p
+                f.semester,
+                f.week_number,
+                ROUND((SUM(f.attended) / NULLIF(SUM(f.enrolled), 0) * 100), 2) AS attendance_percentage
+            FROM wh__fact_session_attendance AS f
             LEFT JOIN wh__courses AS c
-                ON p.course_id = c.id
-            GROUP BY p.semester, c.name, p.course_id, p.week_number
-            HAVING SUM(p.student_enrolled) > 0
-            ORDER BY p.semester, p.course_id, p.week_number 
+                ON f.course_id = c.id{fact_filter}
+            GROUP BY f.semester, c.name, f.course_id, f.week_number
+            HAVING SUM(f.enrolled) > 0
+            ORDER BY f.semester, f.course_id, f.week_number
             """
-            
-            df = pd.read_sql_query(query, self.connection)
+
+    def fetch_data(self):
+        """Fetch data from the datawarehouse tables"""
+        try:
+            df = pd.read_sql_query(self.build_report_query(), self.connection)
             return df
         
         except(Exception, Error) as error:
             print(f"Error while fetching data: {error}")
             return None
-        
+
+    def explain_report_query(self):
+        """Run the report query under EXPLAIN (ANALYZE, BUFFERS) and save the plan with the load timings"""
+        try:
+            self.cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {self.build_report_query()}")
+            plan = self.cursor.fetchone()[0][0]
+            self.connection.rollback()
+
+            os.makedirs(Config.PLAN_PATH, exist_ok=True)
+            run_at = datetime.now()
+            plan_file = os.path.join(Config.PLAN_PATH, f"weekly_report_plan_{run_at:%Y%m%d_%H%M%S}.json")
+            with open(plan_file, 'w') as file:
+                json.dump({
+                    'run_at': run_at.isoformat(timespec='seconds'),
+                    'planning_time_ms': plan.get('Planning Time'),
+                    'execution_time_ms': plan.get('Execution Time'),
+                    'timings_s': self.timings,
+                    'plan': plan,
+                }, file, indent=2)
+            print(f"Report query plan saved to {plan_file} (execution {plan.get('Execution Time')} ms).")
+
+        except(Exception, Error) as error:
+            print(f"Error while explaining report query: {error}")
+            self.errors['explain'] = str(error)
+            self.connection.rollback()
+
     def create_table(self):
         """Create the data mart table for reporting"""
         create_table_query = """
         CREATE TABLE IF NOT EXISTS mart__weekly_attendance (
+            course_id INT NOT NULL,
             course_name VARCHAR(255),
             semester INT,
-            week_number INT,
-            attendance_percentage NUMERIC(5, 2)
+            week_number INT NOT NULL,
+            attendance_percentage NUMERIC(5, 2),
+            UNIQUE NULLS NOT DISTINCT (course_id, semester, week_number)
         );
         """
         try:
+            # The mart is derived data, a table from before it had a key is rebuilt
+            self.cursor.execute(
+                "SELECT column_name FROM information_schema.columns WHERE table_name = 'mart__weekly_attendance'"
+            )
+            columns = [row[0] for row in self.cursor.fetchall()]
+            if columns and 'course_id' not in columns:
+                self.cursor.execute("DROP TABLE mart__weekly_attendance")
+                for table in MART_SOURCE_TABLES:
+                    self.state.reset_watermark(f"mart__weekly_attendance:{table}")
+
             self.cursor.execute(create_table_query)
             self.connection.commit()
             print("Table 'mart__weekly_attendance' created successfully.")
         except(Exception, Error) as error:
             print(f"Error while creating table: {error}")
+            self.errors['create_table'] = str(error)
+            self.connection.rollback()
+
+    def refresh_mart(self):
+        """Recompute only the mart rows whose (course, semester, week) is touched by new warehouse rows"""
+        try:
+            # New rows of each source table are the ones between the mart watermark and the current max ID
+            bounds = {}
+            for table in MART_SOURCE_TABLES:
+                low = self.state.get_watermark(f"mart__weekly_attendance:{table}")
+                self.cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+                bounds[table] = (low, self.cursor.fetchone()[0])
+            params = {
+                f"{table[4:]}_{side}": bound
+                for table, (low, high) in bounds.items()
+                for side, bound in (('low', low), ('high', high))
+            }
+
+            # Session facts carry the course, semester and week of every session
+            self.cursor.execute("""
+                CREATE TEMP TABLE tmp__touched_keys ON COMMIT DROP AS
+                SELECT f.course_id, f.semester, f.week_number
+                FROM wh__fact_session_attendance AS f
+                WHERE f.schedule_id > %(schedules_low)s AND f.schedule_id <= %(schedules_high)s
+                UNION
+                SELECT f.course_id, f.semester, f.week_number
+                FROM wh__attendances AS a
+                JOIN wh__fact_session_attendance AS f
+                    ON f.course_id = a.schedule_id
+                    AND f.schedule_date_key = a.attend_date_key
+                    AND a.attend_dt = to_date(f.schedule_date_key::text, 'YYYYMMDD')
+                WHERE a.id > %(attendances_low)s AND a.id <= %(attendances_high)s
+                UNION
+                SELECT f.course_id, f.semester, f.week_number
+                FROM wh__enrollments AS e
+                JOIN wh__fact_session_attendance AS f
+                    ON f.course_id = e.schedule_id
+                WHERE e.id > %(enrollments_low)s AND e.id <= %(enrollments_high)s
+                UNION
+                SELECT f.course_id, f.semester, f.week_number
+                FROM wh__courses AS c
+                JOIN wh__fact_session_attendance AS f
+                    ON f.course_id = c.id
+                WHERE c.id > %(courses_low)s AND c.id <= %(courses_high)s
+            """, params)
+            touched_keys = self.cursor.rowcount
+
+            # Date keys of every session under the touched keys
+            self.cursor.execute("""
+                SELECT MIN(f.schedule_date_key), MAX(f.schedule_date_key)
+                FROM wh__fact_session_attendance AS f
+                JOIN tmp__touched_keys AS k
+                    ON k.course_id = f.course_id
+                    AND k.semester IS NOT DISTINCT FROM f.semester
+                    AND k.week_number = f.week_number
+            """)
+            date_from, date_to = self.cursor.fetchone()
+
+            self.cursor.execute(f"""
+                CREATE TEMP TABLE tmp__mart_rows ON COMMIT DROP AS
+                {self.build_report_query('tmp__touched_keys')}
+            """, {'date_from': date_from, 'date_to': date_to})
+            self.cursor.execute("""
+                INSERT INTO mart__weekly_attendance (course_id, course_name, semester, week_number, attendance_percentage)
+                SELECT course_id, course_name, semester, week_number, attendance_percentage
+                FROM tmp__mart_rows
+                ON CONFLICT (course_id, semester, week_number) DO UPDATE SET
+                    course_name = EXCLUDED.course_name,
+                    attendance_percentage = EXCLUDED.attendance_percentage
+            """)
+            upserted_rows = self.cursor.rowcount
+
+            # Touched keys that no longer have enrolled students drop out of the report
+            self.cursor.execute("""
+                DELETE FROM mart__weekly_attendance AS m
+                USING tmp__touched_keys AS k
+                WHERE m.course_id = k.course_id
+                    AND m.semester IS NOT DISTINCT FROM k.semester
+                    AND m.week_number = k.week_number
+                    AND NOT EXISTS (
+                        SELECT 1 FROM tmp__mart_rows AS r
+                        WHERE r.course_id = m.course_id
+                            AND r.semester IS NOT DISTINCT FROM m.semester
+                            AND r.week_number = m.week_number
+                    )
+            """)
+
+            for table, (_, high) in bounds.items():
+                self.state.set_watermark(f"mart__weekly_attendance:{table}", high)
+            self.connection.commit()
+            metrics.record(rows_in=touched_keys, rows_out=upserted_rows)
+            print(f"Mart refreshed incrementally: {touched_keys} keys touched, {upserted_rows} rows upserted.")
+
+        except(Exception, Error) as error:
+            print(f"Error while refreshing mart: {error}")
+            self.errors['refresh_mart'] = str(error)
             self.connection.rollback()
     
-    def ingest_data(self, df):
-        """Ingest data to the mart table"""
-        if df is None or df.empty:
-            print("No data to ingest.")
-            return
-        
+    def rebuild_mart(self):
+        """Recompute the whole mart table from the datawarehouse tables"""
+        bounds = {}
+        for table in MART_SOURCE_TABLES:
+            self.cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+            bounds[table] = self.cursor.fetchone()[0]
+
         try:
-            for row in df.itertuples(index=False):
-                insert_query = """
-                INSERT INTO mart__weekly_attendance (course_name, semester, week_number, attendance_percentage)
-                VALUES (%s, %s, %s, %s);
-                """
-                self.cursor.execute(insert_query, (row.course_name, row.semester, row.week_number, row.attendance_percentage))
+            # Truncate, the bulk insert and the watermarks are committed together
+            self.cursor.execute("TRUNCATE mart__weekly_attendance")
+            self.cursor.execute(f"""
+                INSERT INTO mart__weekly_attendance (course_id, course_name, semester, week_number, attendance_percentage)
+                {self.build_report_query()}
+            """)
+            inserted_rows = self.cursor.rowcount
+            for table, high in bounds.items():
+                self.state.set_watermark(f"mart__weekly_attendance:{table}", high)
             self.connection.commit()
-            print("Data inserted into 'mart__weekly_attendance' successfully.")
+            metrics.record(rows_out=inserted_rows)
+            print(f"Mart rebuilt with {inserted_rows} rows.")
 
         except(Exception, Error) as error:
-            print(f"Error while inserting data: {error}")
+            print(f"Error while rebuilding mart: {error}")
+            self.errors['rebuild_mart'] = str(error)
             self.connection.rollback()
 
-    def generate_csv_report(self, df):
-        """Generate csv report from the mart data"""
-        if df is None or df.empty:
-            print("No data to generate report")
-            return
-        
+    def report_copy_query(self, sink_class, split_column=None, value=None):
+        """COPY ... TO STDOUT of the report rows, optionally only those of one semester or course"""
+        percentage = PERCENTAGE_TEXT if sink_class.header else "attendance_percentage"
+        where = ""
+        if split_column:
+            where = self.cursor.mogrify(f" WHERE {split_column} IS NOT DISTINCT FROM %s", (value,)).decode()
+        return f"""
+            COPY (
+                SELECT course_name, semester, week_number, {percentage} AS attendance_percentage
+                FROM mart__weekly_attendance{where}
+                ORDER BY semester, course_id, week_number
+            ) TO STDOUT WITH (FORMAT csv, HEADER {str(sink_class.header).lower()})
+        """
+
+    def export_report(self):
+        """Stream the report from the mart into REPORT_FORMAT files with COPY TO, without holding it in memory"""
+        sink = None
         try:
-            df.to_csv('weekly_attendance_report.csv', index=False)
-            print("CSV report generated successfully")
+            sink_class = report_sink()
+            self.cursor.execute("SELECT EXISTS (SELECT 1 FROM mart__weekly_attendance)")
+            if not self.cursor.fetchone()[0]:
+                print("No data to generate report")
+                return []
+
+            split_column = REPORT_SPLIT_COLUMNS.get(Config.REPORT_SPLIT_BY)
+            if split_column:
+                self.cursor.execute(f"SELECT DISTINCT {split_column} FROM mart__weekly_attendance ORDER BY 1")
+                values = [row[0] for row in self.cursor.fetchall()]
+            else:
+                values = [None]
+
+            paths = []
+            written_bytes = 0
+            for value in values:
+                sink = sink_class(report_path(sink_class, split_column, value))
+                self.cursor.copy_expert(self.report_copy_query(sink_class, split_column, value), sink)
+                sink.close()
+                written_bytes += sink.bytes_written
+                paths.append(sink.path)
+                sink = None
+            self.connection.rollback()
+            metrics.record(files=len(paths), report_mb=round(written_bytes / (1024 * 1024), 3))
+            print(f"{Config.REPORT_FORMAT} report generated successfully ({', '.join(paths)})")
+            return paths
+
         except(Exception, Error) as error:
-            print(f"Error while generating CSV report: {error}")
-        
+            print(f"Error while generating report: {error}")
+            self.errors['report'] = str(error)
+            if sink:
+                sink.abort()
+            self.connection.rollback()
+
+    def timed(self, name, step, *args):
+        """Run a load step as a step of the run metrics and keep its wall time in seconds"""
+        with metrics.step(f"load.{name}") as measured:
+            result = step(*args)
+            if isinstance(result, pd.DataFrame):
+                metrics.record(rows_out=len(result))
+        self.timings[name] = measured['seconds']
+        return result
+
     def run(self):
         """Run the load proses"""
+        self.state.create_tables()
         self.create_table()
-        data = self.fetch_data()
-        self.ingest_data(data)
-        self.generate_csv_report(data)
+        self.timed('refresh_mart', self.refresh_mart if Config.MART_REFRESH == 'incremental' else self.rebuild_mart)
+        self.timed('export_report', self.export_report)
+        if Config.EXPLAIN_REPORT:
+            self.explain_report_query()
         self.close_db()
         print("Load process is finished.")
         print("------------------------------------------")
\ No newline at end of file
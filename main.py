@@ -1,23 +1,118 @@
+import argparse
+import cProfile
+import os
+import pstats
+import tracemalloc
+from datetime import datetime
 from extract import Extractor
 from transform import Transformer
 from load import Loader
+from streaming import StreamingPipeline
+from watch import Watcher
+from db import Database
+from config import Config
+from metrics import metrics
 
-def main():
+def parse_args():
+    parser = argparse.ArgumentParser(description="Attendance ETL pipeline")
+    parser.add_argument('--mode', choices=['batch', 'streaming', 'watch'], default='batch',
+                        help="run the stages one after the other (batch), concurrently on record batches (streaming), "
+                             "or keep polling the source files and load new records as micro-batches (watch)")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue interrupted file and table loads from their last committed checkpoint "
+                             "(source files are only checkpointed with INGEST_MODE=stream, copy mode loads each file "
+                             "in one transaction)")
+    parser.add_argument('--metrics-out', default=None,
+                        help="path of the JSON run report (default: METRICS_PATH/run_<timestamp>.json)")
+    parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'], default=None,
+                        help="profile the run with cProfile or trace memory allocations with tracemalloc")
+    return parser.parse_args()
+
+def run_pipeline(mode='batch'):
+    """Run the pipeline, returns the errors the stages caught and rolled back, keyed by stage"""
     print("Starting ETL pipeline...")
+    errors = {}
+
+    if mode == 'streaming':
+        # Extract, transform and warehouse writes overlap, then the data mart is loaded
+        with metrics.step('streaming'):
+            pipeline = StreamingPipeline()
+            pipeline.run()
+        errors['streaming'] = pipeline.errors
+
+    elif mode == 'watch':
+        # Runs until interrupted, every micro-batch refreshes the mart rows it touches
+        with metrics.step('watch'):
+            Watcher().run()
+
+    else:
+        # Extract data from CSV files to staging database
+        with metrics.step('extract'):
+            extractor = Extractor()
+            extractor.run()
+
+        # Transform data from bronze layer (staging) to silver layer
+        with metrics.step('transform'):
+            transformer = Transformer()
+            transformer.run()
+
+        # Load data mart and generate report
+        with metrics.step('load'):
+            loader = Loader()
+            loader.run()
+
+        errors.update(extract=extractor.errors, transform=transformer.errors, load=loader.errors)
+
+    # All stages share one connection pool, closed once the pipeline is done
+    stats = Database.get().stats()
+    metrics.extra['connection_pool'] = stats
+    print(f"Connection pool: {stats['checkouts']} checkouts, peak {stats['peak_in_use']} of {stats['max_connections']} connections in use.")
+    Database.close()
+
+    errors = {stage: stage_errors for stage, stage_errors in errors.items() if stage_errors}
+    if errors:
+        metrics.extra['errors'] = errors
+        print(f"ETL Pipeline completed with errors: {errors}")
+    else:
+        print("ETL Pipeline completed.")
+    return errors
+
+def main():
+    args = parse_args()
+    if args.resume:
+        Config.RESUME = True
+    run_id = f"{datetime.now():%Y%m%d_%H%M%S}"
+    metrics_path = args.metrics_out or os.path.join(Config.METRICS_PATH, f"run_{run_id}.json")
 
-    # Extract data from CSV files to staging database
-    extractor = Extractor()
-    extractor.run()
+    if args.profile == 'cprofile':
+        profiler = cProfile.Profile()
+        errors = profiler.runcall(run_pipeline, args.mode)
+        profile_path = os.path.splitext(metrics_path)[0] + '.prof'
+        os.makedirs(os.path.dirname(profile_path) or '.', exist_ok=True)
+        profiler.dump_stats(profile_path)
+        metrics.extra['profile'] = profile_path
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+        print(f"cProfile stats saved to {profile_path}")
 
-    # Transform data from bronze layer (staging) to silver layer
-    transformer = Transformer()
-    transformer.run()
+    elif args.profile == 'tracemalloc':
+        tracemalloc.start()
+        errors = run_pipeline(args.mode)
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        top_lines = snapshot.statistics('lineno')[:20]
+        metrics.extra['tracemalloc'] = {
+            'peak_traced_mb': round(peak / (1024 * 1024), 2),
+            'top_allocations': [{'line': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1)} for stat in top_lines],
+        }
+        print(f"Peak traced memory: {peak / (1024 * 1024):.2f} MB")
 
-    # Load data mart and generate report
-    loader = Loader()
-    loader.run()
+    else:
+        errors = run_pipeline(args.mode)
 
-    print("ETL Pipeline completed.")
+    metrics.write(metrics_path)
+    if errors:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
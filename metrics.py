@@ -0,0 +1,113 @@
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from psycopg2.extensions import cursor as BaseCursor
+
+class RunMetrics:
+    """Wall time, row counts, DB round trips and peak RSS of the stages and steps of a pipeline run"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started_at = datetime.now()
+        self.steps = []
+        self.extra = {}
+
+    def open_steps(self):
+        """Steps currently open on this thread, innermost last"""
+        if not hasattr(self.local, 'open_steps'):
+            self.local.open_steps = []
+        return self.local.open_steps
+
+    def count_round_trip(self):
+        """Count one database round trip for every open step of this thread"""
+        for step in self.open_steps():
+            step['db_round_trips'] += 1
+
+    def record(self, **values):
+        """Set values (e.g. rows_in, rows_out) on the innermost open step of this thread"""
+        open_steps = self.open_steps()
+        if open_steps:
+            open_steps[-1].update(values)
+
+    @contextmanager
+    def step(self, name, **labels):
+        """Measure the block as a step of the run"""
+        step = {'name': name, 'rows_in': None, 'rows_out': None, 'db_round_trips': 0, **labels}
+        open_steps = self.open_steps()
+        open_steps.append(step)
+        start_time = time.perf_counter()
+        try:
+            yield step
+        finally:
+            open_steps.remove(step)
+            seconds = time.perf_counter() - start_time
+            rows = step['rows_out'] if step['rows_out'] is not None else step['rows_in']
+            step['seconds'] = round(seconds, 4)
+            step['rows_per_second'] = round(rows / seconds, 1) if rows and seconds > 0 else None
+            step['peak_rss_mb'] = self.peak_rss_mb()
+            with self.lock:
+                self.steps.append(step)
+
+    @staticmethod
+    def peak_rss_mb():
+        """Peak resident set size of the process so far (ru_maxrss is in kilobytes on Linux)"""
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    def report(self):
+        """Run report as a dictionary, steps in the order they finished"""
+        with self.lock:
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'finished_at': datetime.now().isoformat(timespec='seconds'),
+                'peak_rss_mb': self.peak_rss_mb(),
+                **self.extra,
+                'steps': list(self.steps),
+            }
+
+    def write(self, path):
+        """Write the run report as JSON"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(self.report(), file, indent=2, default=str)
+        print(f"Run metrics saved to {path}")
+
+class CountingCursor(BaseCursor):
+    """Cursor that counts its database round trips in the run metrics"""
+
+    def execute(self, query, vars=None):
+        metrics.count_round_trip()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        metrics.count_round_trip()
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        metrics.count_round_trip()
+        return super().copy_expert(sql, file, size)
+
+    # Named (server-side) cursors go to the server on every fetch
+    def fetchone(self):
+        if self.name:
+            metrics.count_round_trip()
+        return super().fetchone()
+
+    def fetchmany(self, size=None):
+        if self.name:
+            metrics.count_round_trip()
+        return super().fetchmany(size) if size is not None else super().fetchmany()
+
+    def fetchall(self):
+        if self.name:
+            metrics.count_round_trip()
+        return super().fetchall()
+
+# Metrics of the current run, shared by every stage of the process
+metrics = RunMetrics()
@@ -0,0 +1,174 @@
+import argparse
+import os
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+import pandas as pd
+from config import Config
+from schemas import schema_for, source_of_file
+from dates import calendar
+from transform import transform_frame
+
+# Columns of the weekly attendance report, in the order of the CSV
+REPORT_COLUMNS = ['course_name', 'semester', 'week_number', 'attendance_percentage']
+
+# Warehouse columns the report needs, read from silver snapshots
+SNAPSHOT_COLUMNS = {
+    'wh__courses': ['id', 'name'],
+    'wh__schedules': ['course_id', 'lecturer_id', 'schedule_date', 'week_number'],
+    'wh__enrollments': ['schedule_id', 'student_id'],
+    'wh__attendances': ['schedule_id', 'attend_dt', 'student_id'],
+}
+
+class OfflineReport:
+    """Weekly attendance report computed in memory from the source CSV files, without PostgreSQL"""
+
+    def __init__(self, source_path=None, snapshot_run_id=None):
+        self.source_path = source_path or Config.SOURCE_PATH
+        self.snapshot_run_id = snapshot_run_id
+        self.tables = {}
+
+    def read_sources(self):
+        """Read the source files with their schemas the way the Extractor stages them: first row per ID, files of
+        the same source in file name order"""
+        frames = {}
+        for file_name in sorted(os.listdir(self.source_path)):
+            if file_name.endswith('.csv'):
+                schema = schema_for(source_of_file(file_name))
+                frames.setdefault(schema.table_name, []).append(schema.read_csv(os.path.join(self.source_path, file_name)))
+        for table_name, table_frames in frames.items():
+            df = table_frames[0] if len(table_frames) == 1 else pd.concat(table_frames, ignore_index=True)
+            self.tables[table_name] = df.drop_duplicates(subset='id', keep='first').reset_index(drop=True)
+
+    def transform(self):
+        """Apply the Transformer transformations and the warehouse keys to every staging frame"""
+        warehouse = {}
+        for table_name, df in self.tables.items():
+            transformed = transform_frame(df.copy(), table_name)
+            # ON CONFLICT DO NOTHING keeps the first session of a (course, lecturer, date)
+            if table_name == 'stg__schedules':
+                transformed = transformed.drop_duplicates(subset=['course_id', 'lecturer_id', 'schedule_date'])
+            warehouse[f"wh_{table_name[4:]}"] = transformed
+        return warehouse
+
+    def read_snapshots(self):
+        """Read the transformed frames from the silver snapshots of a full pipeline run"""
+        from snapshot import SnapshotStore
+
+        snapshots = SnapshotStore(run_id=self.snapshot_run_id)
+        warehouse = {}
+        for table_name, columns in SNAPSHOT_COLUMNS.items():
+            df = snapshots.read('silver', table_name, columns=columns)
+            if table_name == 'wh__schedules':
+                df = df.drop_duplicates(subset=['course_id', 'lecturer_id', 'schedule_date'])
+            warehouse[table_name] = df
+        return warehouse
+
+    @staticmethod
+    def semester(dates):
+        """Semester of every date from the date dimension, like the report query"""
+        known_dates = dates.dropna()
+        if known_dates.empty:
+            return pd.Series(np.nan, index=dates.index)
+        dimension = calendar(known_dates.min(), known_dates.max()).set_index('calendar_date')['semester']
+        return dates.map(dimension)
+
+    @staticmethod
+    def percentage(attended, enrolled):
+        """ROUND(attended / enrolled * 100, 2) with the half-up rounding of PostgreSQL numerics"""
+        value = Decimal(int(attended)) / Decimal(int(enrolled)) * 100
+        return float(value.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+    def build_report(self):
+        """Weekly attendance percentages per course, semester and week"""
+        if self.snapshot_run_id:
+            warehouse = self.read_snapshots()
+        else:
+            if not self.tables:
+                self.read_sources()
+            warehouse = self.transform()
+
+        schedules = warehouse['wh__schedules'][['course_id', 'schedule_date', 'week_number']].copy()
+        schedules['schedule_date'] = pd.to_datetime(schedules['schedule_date'])
+        attendances = warehouse['wh__attendances'].assign(
+            attend_dt=lambda df: pd.to_datetime(df['attend_dt'])
+        )
+        schedules['semester'] = self.semester(schedules['schedule_date'])
+
+        attendance_sum = (attendances.dropna(subset=['student_id'])
+                          .groupby(['schedule_id', 'attend_dt']).size().rename('student_atd').reset_index())
+        enrollments = warehouse['wh__enrollments']
+        enrollment_num = (enrollments.dropna(subset=['student_id'])
+                          .groupby('schedule_id').size().rename('student_enr').reset_index())
+
+        # Same joins as the report query: attendance by (course_id, date), enrollment by course_id
+        sessions = schedules.merge(
+            attendance_sum, how='left',
+            left_on=['course_id', 'schedule_date'], right_on=['schedule_id', 'attend_dt']
+        ).drop(columns=['schedule_id', 'attend_dt'])
+        sessions = sessions.merge(
+            enrollment_num, how='left', left_on='course_id', right_on='schedule_id'
+        ).drop(columns=['schedule_id'])
+        sessions[['student_atd', 'student_enr']] = sessions[['student_atd', 'student_enr']].fillna(0).astype(np.int64)
+
+        courses = warehouse['wh__courses'][['id', 'name']].rename(columns={'id': 'course_id', 'name': 'course_name'})
+        sessions = sessions.merge(courses, how='left', on='course_id')
+
+        weekly = (sessions.groupby(['semester', 'course_name', 'course_id', 'week_number'], dropna=False)
+                  [['student_atd', 'student_enr']].sum().reset_index())
+        weekly = weekly[weekly['student_enr'] > 0]
+        weekly['attendance_percentage'] = [
+            self.percentage(attended, enrolled)
+            for attended, enrolled in zip(weekly['student_atd'], weekly['student_enr'])
+        ]
+        weekly = weekly.sort_values(['semester', 'course_id', 'week_number'], na_position='last', kind='stable')
+        if weekly['semester'].notna().all():
+            weekly['semester'] = weekly['semester'].astype(np.int64)
+        return weekly[['course_id'] + REPORT_COLUMNS].reset_index(drop=True)
+
+    def generate_csv_report(self, output_file='weekly_attendance_report.csv'):
+        """Write the report with the same columns and format as the Loader"""
+        report = self.build_report()
+        report[REPORT_COLUMNS].to_csv(output_file, index=False)
+        print(f"Offline report with {len(report)} rows written to {output_file}.")
+        return report
+
+    def compare_with_database(self):
+        """Compare the offline report with the report query over the data warehouse, returns whether they match"""
+        from load import Loader
+
+        offline_report = self.build_report()[REPORT_COLUMNS]
+        loader = Loader()
+        database_report = loader.fetch_data()
+        loader.close_db()
+        if database_report is None:
+            return False
+        database_report = database_report[REPORT_COLUMNS].astype({'attendance_percentage': float})
+
+        try:
+            pd.testing.assert_frame_equal(
+                offline_report.reset_index(drop=True), database_report.reset_index(drop=True),
+                check_dtype=False
+            )
+        except AssertionError as error:
+            print(f"Offline and database reports differ: {error}")
+            return False
+        print(f"Offline and database reports match ({len(offline_report)} rows).")
+        return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Weekly attendance report from the source CSV files, without a database")
+    parser.add_argument('--source', default=Config.SOURCE_PATH, help="directory of the source CSV files")
+    parser.add_argument('--output', default='weekly_attendance_report.csv', help="report CSV to write")
+    parser.add_argument('--snapshot', default=None, metavar='RUN_ID',
+                        help="read the transformed tables from the silver snapshots of a full pipeline run instead")
+    parser.add_argument('--compare', action='store_true',
+                        help="also check the report against the report query of the data warehouse")
+    args = parser.parse_args()
+
+    report = OfflineReport(args.source, args.snapshot)
+    report.generate_csv_report(args.output)
+    if args.compare and not report.compare_with_database():
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import warnings
+import pandas as pd
+from config import Config
+from schemas import schema_for
+
+# Same format as schemas.DATE_FORMAT (%d-%b-%y) in PostgreSQL's to_date notation
+SQL_DATE_FORMAT = 'DD-Mon-YY'
+
+def parse_date(column):
+    """SQL expression parsing a staging date column"""
+    return f"to_date({column}, '{SQL_DATE_FORMAT}')"
+
+def date_key(expression):
+    """SQL expression of the integer YYYYMMDD key of a date expression"""
+    return f"to_char({expression}, 'YYYYMMDD')::integer"
+
+def id_range(alias, incremental):
+    """Condition on the staging IDs to transform, the rows above the watermark up to the high-water mark"""
+    if incremental:
+        return f"{alias}.id > %(watermark)s AND {alias}.id <= %(high_water)s"
+    return f"{alias}.id <= %(high_water)s"
+
+def select_query(table_name, incremental=True):
+    """Warehouse columns and the SELECT computing them from a staging table, the same transformation as transform_frame
+
+    The query takes watermark, high_water and, for schedules, id_offset parameters.
+    """
+    if table_name == 'stg__schedules':
+        start_dt = parse_date('s.start_dt')
+        end_dt = parse_date('s.end_dt')
+        # Same weekday numbering as the pandas path, Monday is 2
+        course_day = "EXTRACT(ISODOW FROM d.day)::integer + 1"
+        columns = ['id', 'course_id', 'lecturer_id', 'start_dt', 'end_dt', 'course_day', 'schedule_date',
+                   'week_number', 'schedule_date_key']
+        query = f"""
+            SELECT
+                ROW_NUMBER() OVER (ORDER BY s.id, d.day) + %(id_offset)s AS id,
+                s.course_id,
+                s.lecturer_id,
+                {start_dt} AS start_dt,
+                {end_dt} AS end_dt,
+                {course_day} AS course_day,
+                d.day::date AS schedule_date,
+                (d.day::date - {start_dt}) / 7 + 1 AS week_number,
+                {date_key('d.day')} AS schedule_date_key
+            FROM stg__schedules AS s
+            CROSS JOIN LATERAL generate_series({start_dt}, {end_dt}, interval '1 day') AS d (day)
+            WHERE {id_range('s', incremental)}
+                AND {course_day} = ANY (string_to_array(s.course_days, ',')::integer[])
+        """
+    elif table_name == 'stg__enrollments':
+        columns = ['id', 'student_id', 'schedule_id', 'academic_year', 'semester', 'enroll_dt', 'enroll_date_key']
+        query = f"""
+            SELECT
+                s.id,
+                s.student_id,
+                s.schedule_id,
+                s.academic_year,
+                s.semester,
+                {parse_date('s.enroll_dt')} AS enroll_dt,
+                {date_key(parse_date('s.enroll_dt'))} AS enroll_date_key
+            FROM stg__enrollments AS s
+            WHERE {id_range('s', incremental)}
+        """
+    elif table_name == 'stg__attendances':
+        columns = ['id', 'schedule_id', 'student_id', 'attend_dt', 'attend_date_key']
+        query = f"""
+            SELECT
+                s.id,
+                s.schedule_id,
+                s.student_id,
+                {parse_date('s.attend_dt')} AS attend_dt,
+                {date_key(parse_date('s.attend_dt'))} AS attend_date_key
+            FROM stg__attendances AS s
+            WHERE {id_range('s', incremental)}
+        """
+    else:
+        columns = ['id', 'name']
+        query = f"""
+            SELECT s.id, s.name
+            FROM {table_name} AS s
+            WHERE {id_range('s', incremental)}
+        """
+    return columns, query
+
+def date_range_query(table_name, incremental=True):
+    """First and last warehouse date of the staging rows to transform, for partitions and the date dimension"""
+    if table_name == 'stg__schedules':
+        first, last = parse_date('s.start_dt'), parse_date('s.end_dt')
+    elif table_name == 'stg__enrollments':
+        first = last = parse_date('s.enroll_dt')
+    elif table_name == 'stg__attendances':
+        first = last = parse_date('s.attend_dt')
+    else:
+        return None
+    return f"SELECT MIN({first}), MAX({last}) FROM {table_name} AS s WHERE {id_range('s', incremental)}"
+
+def uses_pushdown(table_name):
+    """Whether PUSHDOWN_TABLES selects the in-database engine for a staging table"""
+    return 'all' in Config.PUSHDOWN_TABLES or table_name in Config.PUSHDOWN_TABLES or table_name[5:] in Config.PUSHDOWN_TABLES
+
+def normalize(df):
+    """Frame with comparable values: dates as ISO strings, numbers as int64, rows in key order"""
+    df = df.copy()
+    for column in df.columns:
+        values = df[column]
+        if pd.api.types.is_datetime64_any_dtype(values) or column in ('start_dt', 'end_dt', 'schedule_date', 'enroll_dt', 'attend_dt'):
+            df[column] = pd.to_datetime(values).dt.strftime('%Y-%m-%d')
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            df[column] = values.astype(object)
+        elif pd.api.types.is_numeric_dtype(values):
+            df[column] = values.astype('int64')
+        else:
+            df[column] = values.astype(object)
+    return df.sort_values('id').reset_index(drop=True)
+
+def verify(connection, table_name):
+    """Compare the pushdown SELECT with transform_frame on a whole staging table, returns the differences or None"""
+    from transform import transform_frame
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table_name}")
+        high_water = cursor.fetchone()[0]
+    columns, query = select_query(table_name, incremental=False)
+    pushdown_df = pd.read_sql_query(query, connection, params={'high_water': high_water, 'id_offset': 0})
+
+    staging_df = schema_for(table_name).compact(pd.read_sql_query(f"SELECT * FROM {table_name} ORDER BY id", connection))
+    pandas_df = transform_frame(staging_df, table_name)[columns]
+
+    try:
+        pd.testing.assert_frame_equal(normalize(pandas_df), normalize(pushdown_df[columns]), check_dtype=False)
+    except AssertionError as error:
+        return str(error)
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the in-database transformations match the pandas ones")
+    parser.add_argument('tables', nargs='*', default=['stg__courses', 'stg__schedules', 'stg__enrollments', 'stg__attendances'],
+                        help="staging tables to compare (default: all)")
+    args = parser.parse_args()
+
+    from db import Database
+
+    warnings.filterwarnings("ignore", category=UserWarning, message="pandas only supports SQLAlchemy connectable")
+    mismatches = 0
+    with Database.get().session() as connection:
+        for table_name in args.tables:
+            difference = verify(connection, table_name)
+            if difference:
+                mismatches += 1
+                print(f"{table_name}: pushdown and pandas transformations differ\n{difference}")
+            else:
+                print(f"{table_name}: pushdown and pandas transformations match.")
+    Database.close()
+    if mismatches:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
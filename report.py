@@ -0,0 +1,121 @@
+import gzip
+import os
+from config import Config
+from schemas import record_end
+
+# Columns of the weekly attendance report, in output order
+REPORT_COLUMNS = ('course_name', 'semester', 'week_number', 'attendance_percentage')
+
+class CsvSink:
+    """Report file receiving the CSV stream of COPY ... TO STDOUT, written under a temporary name until it is complete"""
+    extension = 'csv'
+    # The header line and the percentage text come from COPY itself
+    header = True
+
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.bytes_written = 0
+        self.file = self.open(self.temp_path)
+
+    def open(self, path):
+        """Open the temporary file for binary writes"""
+        return open(path, 'wb')
+
+    def write(self, data):
+        """Called by COPY with every block of the stream"""
+        self.file.write(data)
+        self.bytes_written += len(data)
+
+    def close(self):
+        """Finish the file and move it into place"""
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        """Drop the partial file of a failed export"""
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class GzipCsvSink(CsvSink):
+    """Gzip-compressed CSV report file"""
+    extension = 'csv.gz'
+
+    def open(self, path):
+        return gzip.open(path, 'wb')
+
+class ParquetSink(CsvSink):
+    """Parquet report file, the CSV stream is converted one block of complete records at a time"""
+    extension = 'parquet'
+    header = False
+    # Bytes of CSV converted into each row group
+    BLOCK_BYTES = 8 * 1024 * 1024
+
+    def open(self, path):
+        # pyarrow is only needed for Parquet reports
+        import pyarrow
+        import pyarrow.csv
+        import pyarrow.parquet
+
+        self.pa = pyarrow
+        self.csv = pyarrow.csv
+        self.schema = pyarrow.schema([
+            ('course_name', pyarrow.string()),
+            ('semester', pyarrow.int32()),
+            ('week_number', pyarrow.int32()),
+            ('attendance_percentage', pyarrow.float64()),
+        ])
+        self.buffer = bytearray()
+        self.rows_written = 0
+        return pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, data):
+        self.buffer += data
+        self.bytes_written += len(data)
+        if len(self.buffer) >= self.BLOCK_BYTES:
+            self.flush(final=False)
+
+    def record_end(self):
+        """Position after the last complete record in the buffer, a newline inside quotes does not end a record"""
+        return record_end(self.buffer)
+
+    def flush(self, final=True):
+        """Convert the complete records in the buffer into a row group"""
+        end = len(self.buffer) if final else self.record_end()
+        if end == 0:
+            return
+        block = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        table = self.csv.read_csv(
+            self.pa.py_buffer(block),
+            read_options=self.csv.ReadOptions(column_names=list(REPORT_COLUMNS)),
+            convert_options=self.csv.ConvertOptions(column_types=self.schema)
+        )
+        self.file.write_table(table)
+        self.rows_written += table.num_rows
+
+    def close(self):
+        self.flush()
+        super().close()
+
+# Sink class of each REPORT_FORMAT
+REPORT_SINKS = {
+    'csv': CsvSink,
+    'csv.gz': GzipCsvSink,
+    'parquet': ParquetSink,
+}
+
+def report_sink(report_format=None):
+    """Sink class of a report format, raises ValueError for an unknown format"""
+    report_format = report_format or Config.REPORT_FORMAT
+    if report_format not in REPORT_SINKS:
+        raise ValueError(f"Unknown report format {report_format}, expected one of {', '.join(REPORT_SINKS)}")
+    return REPORT_SINKS[report_format]
+
+def report_path(sink_class, split_column=None, value=None):
+    """Path of a report file, split reports get one file per semester or course"""
+    if split_column is None:
+        return f"{Config.REPORT_PATH}.{sink_class.extension}"
+    label = 'none' if value is None else value
+    return f"{Config.REPORT_PATH}_{split_column.split('_')[0]}_{label}.{sink_class.extension}"
@@ -0,0 +1,186 @@
+import argparse
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from config import Config
+
+def config_value(key, value):
+    """Manifest setting converted to the type of the Config attribute it overrides, e.g. "4" for EXTRACT_WORKERS"""
+    current = getattr(Config, key)
+    if isinstance(current, bool):
+        return value if isinstance(value, bool) else str(value).lower() == 'true'
+    if isinstance(current, (int, float)):
+        return type(current)(value)
+    if isinstance(current, list):
+        items = value if isinstance(value, list) else [item.strip() for item in str(value).split(',') if item.strip()]
+        return [type(current[0])(item) for item in items] if current else items
+    return str(value)
+
+def load_manifest(manifest_path):
+    """Jobs of a manifest, each with a name, a source_path, a db_schema and optional report_path, mode and config"""
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+    jobs = manifest['jobs'] if isinstance(manifest, dict) else manifest
+
+    names = set()
+    for job in jobs:
+        missing = [key for key in ('name', 'source_path', 'db_schema') if key not in job]
+        if missing:
+            raise ValueError(f"Job {job.get('name', job)} of {manifest_path} is missing {', '.join(missing)}")
+        if job['name'] in names:
+            raise ValueError(f"Job name {job['name']} appears twice in {manifest_path}")
+        unknown = [key for key in job.get('config', {}) if not hasattr(Config, key)]
+        if unknown:
+            raise ValueError(f"Job {job['name']} sets unknown settings {', '.join(unknown)}")
+        for key, value in job.get('config', {}).items():
+            try:
+                config_value(key, value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Job {job['name']} sets {key} to {value!r}, which is not a valid "
+                                 f"{type(getattr(Config, key)).__name__}")
+        names.add(job['name'])
+    return jobs
+
+def step_total(steps, name, field):
+    """Sum of a field over the steps with the given name"""
+    return sum(step.get(field) or 0 for step in steps if step['name'] == name)
+
+def run_job(job, run_id):
+    """Run the pipeline for one job in this process, with its own settings, connection pool and run metrics"""
+    # Every job runs in a fresh process, so these settings and the pool only belong to this job
+    Config.SOURCE_PATH = job['source_path']
+    Config.DB_SCHEMA = job['db_schema']
+    Config.REPORT_PATH = job.get('report_path', f"{Config.REPORT_PATH}_{job['name']}")
+    for key, value in job.get('config', {}).items():
+        setattr(Config, key, config_value(key, value))
+
+    from main import run_pipeline
+    from metrics import metrics
+
+    metrics.extra['job'] = job['name']
+    metrics_path = os.path.join(Config.METRICS_PATH, f"run_{run_id}_{job['name']}.json")
+    start_time = time.perf_counter()
+    status = 'finished'
+    error = None
+    errors = {}
+    try:
+        errors = run_pipeline(job.get('mode', 'batch'))
+        if errors:
+            status = 'failed'
+            error = '; '.join(f"{stage} {key}: {message}" for stage, stage_errors in errors.items()
+                              for key, message in stage_errors.items())
+    except Exception as exception:
+        status = 'failed'
+        error = str(exception)
+    if error:
+        print(f"Job {job['name']} failed: {error}")
+    seconds = time.perf_counter() - start_time
+    metrics.write(metrics_path)
+
+    steps = metrics.report()['steps']
+    return {
+        'name': job['name'],
+        'source_path': job['source_path'],
+        'db_schema': job['db_schema'],
+        'status': status,
+        'error': error,
+        'errors': errors,
+        'seconds': round(seconds, 2),
+        'stage_seconds': {stage: round(step_total(steps, stage, 'seconds'), 2) for stage in ('extract', 'transform', 'load')},
+        'rows_staged': step_total(steps, 'extract.file', 'rows_out'),
+        'rows_written': step_total(steps, 'transform.write', 'rows_out'),
+        'peak_rss_mb': metrics.peak_rss_mb(),
+        'metrics_path': metrics_path,
+    }
+
+class Runner:
+    """Run the pipeline for every job of a manifest, at most RUNNER_WORKERS jobs at a time, each in its own process"""
+
+    def __init__(self, manifest_path, workers=None):
+        self.manifest_path = manifest_path
+        self.jobs = load_manifest(manifest_path)
+        self.workers = max(1, min(workers or Config.RUNNER_WORKERS, len(self.jobs) or 1))
+        self.run_id = f"{datetime.now():%Y%m%d_%H%M%S}"
+
+    def run(self):
+        """Run the jobs and return the aggregated summary"""
+        print(f"Running {len(self.jobs)} jobs from {self.manifest_path} with {self.workers} workers...")
+        start_time = time.perf_counter()
+        results = []
+        # Every job gets a freshly spawned process, so no settings, pool or metrics leak between jobs
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, max_tasks_per_child=1) as executor:
+            futures = {executor.submit(run_job, job, self.run_id): job for job in self.jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as exception:
+                    # The job process itself died
+                    result = {'name': job['name'], 'source_path': job['source_path'], 'db_schema': job['db_schema'],
+                              'status': 'failed', 'error': str(exception), 'seconds': None}
+                results.append(result)
+                print(f"Job {result['name']} {result['status']} in {result['seconds']}s.")
+
+        wall_seconds = time.perf_counter() - start_time
+        job_seconds = sum(result['seconds'] or 0 for result in results)
+        order = [job['name'] for job in self.jobs]
+        summary = {
+            'run_id': self.run_id,
+            'manifest': self.manifest_path,
+            'workers': self.workers,
+            'jobs': len(results),
+            'failed': sum(1 for result in results if result['status'] != 'finished'),
+            'wall_seconds': round(wall_seconds, 2),
+            'sum_job_seconds': round(job_seconds, 2),
+            'slowest_job': max(results, key=lambda result: result['seconds'] or 0)['name'] if results else None,
+            'rows_staged': sum(result.get('rows_staged') or 0 for result in results),
+            'rows_written': sum(result.get('rows_written') or 0 for result in results),
+            'results': sorted(results, key=lambda result: order.index(result['name'])),
+        }
+        self.print_summary(summary)
+        return summary
+
+    def print_summary(self, summary):
+        """Print one line per job and the totals of the run"""
+        print("------------------------------------------")
+        for result in summary['results']:
+            line = f"{result['name']:<20} {result['status']:<9} {result['seconds'] or 0:>8.2f}s"
+            if result.get('rows_staged') is not None:
+                line += f"  {result['rows_staged']} rows staged, {result['rows_written']} rows written"
+            if result['error']:
+                line += f"  ({result['error']})"
+            print(line)
+        print(f"{summary['jobs']} jobs, {summary['failed']} failed, {summary['wall_seconds']:.2f}s wall time for "
+              f"{summary['sum_job_seconds']:.2f}s of jobs, slowest job {summary['slowest_job']}.")
+
+    def write_summary(self, summary, path=None):
+        """Write the summary as JSON next to the run metrics"""
+        path = path or os.path.join(Config.METRICS_PATH, f"runner_{self.run_id}.json")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(summary, file, indent=2, default=str)
+        print(f"Runner summary saved to {path}")
+        return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the pipeline for several source directories and databases")
+    parser.add_argument('manifest', help="JSON manifest of the jobs")
+    parser.add_argument('--workers', type=int, default=None, help="jobs run at the same time (default: RUNNER_WORKERS)")
+    parser.add_argument('--summary-out', default=None,
+                        help="path of the JSON summary (default: METRICS_PATH/runner_<timestamp>.json)")
+    args = parser.parse_args()
+
+    runner = Runner(args.manifest, args.workers)
+    summary = runner.run()
+    runner.write_summary(summary, args.summary_out)
+    if summary['failed']:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
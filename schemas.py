@@ -0,0 +1,142 @@
+import csv
+import os
+import pandas as pd
+
+# Format of every date in the source files, e.g. 09-Sep-19
+DATE_FORMAT = "%d-%b-%y"
+
+class SchemaError(ValueError):
+    """A source file whose columns do not match its declared schema"""
+
+def to_dates(values):
+    """Parse source date strings to datetime64, values that are already parsed are returned as they are"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    return pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+
+def record_end(data):
+    """Position after the last complete CSV record in data, a newline inside a quoted field does not end a record"""
+    end = data.rfind(b'\n')
+    while end >= 0 and data.count(b'"', 0, end) % 2:
+        end = data.rfind(b'\n', 0, end)
+    return end + 1
+
+class SourceSchema:
+    """Declared columns of a source file with the compact dtype of each column"""
+    # Column kinds: 'id' is stored as int32, 'code' (a small integer code) and 'category' as pandas
+    # categoricals of integers and strings, 'date' as datetime64 once parsed and 'text' as a string
+    def __init__(self, name, columns):
+        self.name = name
+        self.table_name = f"stg__{name}"
+        self.columns = columns
+
+    def validate(self, columns, source=None):
+        """Raise a SchemaError when the columns differ from the declared ones"""
+        columns = [column.strip().lower() for column in columns]
+        missing = [column for column in self.columns if column not in columns]
+        unexpected = [column for column in columns if column not in self.columns]
+        if missing or unexpected:
+            raise SchemaError(f"{source or self.name} does not match the {self.name} schema "
+                              f"(missing: {missing or 'none'}, unexpected: {unexpected or 'none'})")
+        return columns
+
+    def read_header(self, file_path):
+        """Validated lower-case column names of a source file, in file order"""
+        with open(file_path, 'r', newline='') as file:
+            header = next(csv.reader(file), [])
+        return self.validate(header, file_path)
+
+    def csv_dtypes(self):
+        """read_csv dtypes of the declared columns, dates are kept as text until they are parsed"""
+        dtypes = {}
+        for column, kind in self.columns.items():
+            if kind == 'id':
+                # Nullable while reading, compact() narrows complete columns to int32
+                dtypes[column] = 'Int32'
+            elif kind == 'category':
+                dtypes[column] = 'category'
+            elif kind == 'code':
+                dtypes[column] = 'Int8'
+            else:
+                dtypes[column] = str
+        return dtypes
+
+    def read_csv(self, file_path, parse_dates=True, columns=None, **kwargs):
+        """Read a source file with the declared dtypes, returns a frame or an iterator of chunks with chunksize
+
+        With columns, file_path is any path or buffer of records without a header line, in that column order.
+        """
+        header = None if columns else 0
+        columns = columns or self.read_header(file_path)
+        # Empty fields are NULL like in COPY, any other value is read as it is in the file
+        frames = pd.read_csv(file_path, header=header, names=columns, dtype=self.csv_dtypes(),
+                             keep_default_na=False, na_values=[''], **kwargs)
+        if 'chunksize' in kwargs:
+            return (self.compact(chunk, parse_dates) for chunk in frames)
+        return self.compact(frames, parse_dates)
+
+    def compact(self, df, parse_dates=True):
+        """Cast the declared columns of a frame to their compact dtypes"""
+        for column, kind in self.columns.items():
+            if column not in df.columns:
+                continue
+            if kind == 'id':
+                values = pd.to_numeric(df[column], errors='coerce')
+                # int32 for complete columns, float64 like a staging read when some IDs are NULL
+                df[column] = values.astype('int32') if values.notna().all() else values.astype('float64')
+            elif kind == 'code':
+                values = pd.to_numeric(df[column], errors='coerce')
+                df[column] = (values.astype('int64') if values.notna().all() else values).astype('category')
+            elif kind == 'category':
+                df[column] = df[column].astype('category')
+            elif kind == 'date' and parse_dates:
+                df[column] = to_dates(df[column])
+        return df
+
+# Registry of the source files, keyed by file name without extension
+SOURCE_SCHEMAS = {
+    'courses': SourceSchema('courses', {
+        'id': 'id',
+        'name': 'text',
+    }),
+    'schedules': SourceSchema('schedules', {
+        'id': 'id',
+        'course_id': 'id',
+        'lecturer_id': 'id',
+        'start_dt': 'date',
+        'end_dt': 'date',
+        'course_days': 'category',
+    }),
+    'enrollments': SourceSchema('enrollments', {
+        'id': 'id',
+        'student_id': 'id',
+        'schedule_id': 'id',
+        'academic_year': 'category',
+        'semester': 'code',
+        'enroll_dt': 'date',
+    }),
+    'attendances': SourceSchema('attendances', {
+        'id': 'id',
+        'student_id': 'id',
+        'schedule_id': 'id',
+        'attend_dt': 'date',
+    }),
+}
+
+def schema_for(name):
+    """Schema of a source file path, file name or staging table name, raises SchemaError when none is declared"""
+    name = os.path.splitext(os.path.basename(name))[0]
+    if name.startswith('stg__'):
+        name = name[len('stg__'):]
+    if name not in SOURCE_SCHEMAS:
+        raise SchemaError(f"No schema is declared for {name}")
+    return SOURCE_SCHEMAS[name]
+
+def source_of_file(file_path):
+    """Declared source of a file, by its exact name or by a name prefix like attendances_20241017.csv, the longest
+    declared name wins, raises SchemaError when none matches"""
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    matches = [source for source in SOURCE_SCHEMAS if name.startswith(source)]
+    if not matches:
+        raise SchemaError(f"No schema is declared for {name}")
+    return max(matches, key=len)
@@ -0,0 +1,86 @@
+import os
+import shutil
+import threading
+from datetime import datetime
+from config import Config
+
+class SnapshotStore:
+    """Parquet snapshots of the parsed source data (bronze) and the transformed frames (silver), keyed by run and table"""
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, root=None, run_id=None):
+        # pyarrow is only needed when snapshots are enabled
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.root = root or Config.SNAPSHOT_PATH
+        self.run_id = run_id or Config.SNAPSHOT_RUN_ID or f"{datetime.now():%Y%m%d_%H%M%S}"
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        """Return the snapshot store of this process, or None when snapshots are disabled"""
+        if not Config.SNAPSHOT_ENABLED:
+            return None
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+                print(f"Snapshots of run {cls._instance.run_id} are stored in {cls._instance.root}.")
+            return cls._instance
+
+    def path(self, layer, table_name):
+        """Directory holding the snapshot parts of a table"""
+        return os.path.join(self.root, self.run_id, layer, table_name)
+
+    def exists(self, layer, table_name):
+        """Whether the run has a snapshot of the table"""
+        path = self.path(layer, table_name)
+        return os.path.isdir(path) and any(name.endswith('.parquet') for name in os.listdir(path))
+
+    def clear(self, layer, table_name):
+        """Remove the snapshot of a table, before it is written again"""
+        shutil.rmtree(self.path(layer, table_name), ignore_errors=True)
+
+    def write(self, layer, table_name, df, **metadata):
+        """Add a frame as the next part of the table snapshot, with optional key-value metadata"""
+        path = self.path(layer, table_name)
+        table = self.pa.Table.from_pandas(df, preserve_index=False)
+        if metadata:
+            schema_metadata = dict(table.schema.metadata or {})
+            schema_metadata.update({f"snapshot.{key}".encode(): str(value).encode() for key, value in metadata.items()})
+            table = table.replace_schema_metadata(schema_metadata)
+
+        with self.lock:
+            os.makedirs(path, exist_ok=True)
+            part = len([name for name in os.listdir(path) if name.endswith('.parquet')])
+            part_path = os.path.join(path, f"part-{part:05d}.parquet")
+            # Parts are renamed into place so a failed run never leaves a truncated part behind
+            self.pq.write_table(table, f"{part_path}.tmp")
+            os.replace(f"{part_path}.tmp", part_path)
+        return part_path
+
+    def read(self, layer, table_name, columns=None, filters=None):
+        """Read a table snapshot, only the given columns and the row groups matching the filters"""
+        parts = self.parts(layer, table_name)
+        tables = [self.pq.read_table(part, columns=columns, filters=filters) for part in parts]
+        # Parts written from different chunks may differ in type, e.g. integers with and without nulls
+        return self.pa.concat_tables(tables, promote_options='permissive').to_pandas()
+
+    def parts(self, layer, table_name):
+        """Snapshot part files of a table, in write order"""
+        path = self.path(layer, table_name)
+        return sorted(os.path.join(path, name) for name in os.listdir(path) if name.endswith('.parquet'))
+
+    def metadata(self, layer, table_name):
+        """Metadata of every part of a table snapshot"""
+        parts_metadata = []
+        for part in self.parts(layer, table_name):
+            schema_metadata = self.pq.read_schema(part).metadata or {}
+            parts_metadata.append({
+                key.decode()[len('snapshot.'):]: value.decode()
+                for key, value in schema_metadata.items() if key.startswith(b'snapshot.')
+            })
+        return parts_metadata
@@ -0,0 +1,134 @@
+import hashlib
+import os
+from psycopg2 import Error
+
+class PipelineState:
+    """Bookkeeping for incremental and resumed runs: source file fingerprints, per-table high-water marks and chunk checkpoints"""
+
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+
+    def create_tables(self):
+        """Create the pipeline state tables"""
+        create_tables_query = """
+        CREATE TABLE IF NOT EXISTS pipeline__file_state (
+            file_path VARCHAR(1024) PRIMARY KEY,
+            file_size BIGINT NOT NULL,
+            file_mtime DOUBLE PRECISION NOT NULL,
+            file_hash VARCHAR(64) NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+
+        CREATE TABLE IF NOT EXISTS pipeline__watermarks (
+            table_name VARCHAR(255) PRIMARY KEY,
+            high_water BIGINT NOT NULL,
+            updated_at TIMESTAMP NOT NULL DEFAULT now()
+        );
+
+        CREATE TABLE IF NOT EXISTS pipeline__checkpoints (
+            source VARCHAR(1024) NOT NULL,
+            target_table VARCHAR(255) NOT NULL,
+            source_version VARCHAR(255) NOT NULL,
+            rows_committed BIGINT NOT NULL,
+            id_offset BIGINT NOT NULL DEFAULT 0,
+            byte_offset BIGINT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            PRIMARY KEY (source, target_table)
+        );
+
+        ALTER TABLE pipeline__checkpoints ADD COLUMN IF NOT EXISTS byte_offset BIGINT NOT NULL DEFAULT 0;
+        """
+        try:
+            self.cursor.execute(create_tables_query)
+            self.connection.commit()
+        except(Exception, Error) as error:
+            print(f"Error while creating pipeline state tables: {error}")
+            self.connection.rollback()
+
+    @staticmethod
+    def file_hash(file_path):
+        """SHA-256 of the file content, read in blocks"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def check_file(self, file_path):
+        """Return whether the file changed since it was last recorded, together with its current fingerprint"""
+        stat = os.stat(file_path)
+        self.cursor.execute(
+            "SELECT file_size, file_mtime, file_hash FROM pipeline__file_state WHERE file_path = %s",
+            (file_path,)
+        )
+        recorded = self.cursor.fetchone()
+
+        # Same size and modification time is taken as unchanged without reading the file
+        if recorded and recorded[0] == stat.st_size and recorded[1] == stat.st_mtime:
+            return False, recorded
+
+        fingerprint = (stat.st_size, stat.st_mtime, self.file_hash(file_path))
+        changed = not recorded or recorded[2] != fingerprint[2]
+        return changed, fingerprint
+
+    def record_file(self, file_path, fingerprint):
+        """Save the fingerprint of a file that was fully ingested"""
+        self.cursor.execute("""
+            INSERT INTO pipeline__file_state (file_path, file_size, file_mtime, file_hash, updated_at)
+            VALUES (%s, %s, %s, %s, now())
+            ON CONFLICT (file_path) DO UPDATE SET
+                file_size = EXCLUDED.file_size,
+                file_mtime = EXCLUDED.file_mtime,
+                file_hash = EXCLUDED.file_hash,
+                updated_at = EXCLUDED.updated_at
+        """, (file_path, *fingerprint))
+
+    def get_watermark(self, table_name):
+        """Highest ID already processed for the table, 0 when it was never processed"""
+        self.cursor.execute("SELECT high_water FROM pipeline__watermarks WHERE table_name = %s", (table_name,))
+        row = self.cursor.fetchone()
+        return row[0] if row else 0
+
+    def set_watermark(self, table_name, high_water):
+        """Move the high-water mark of the table forward"""
+        self.cursor.execute("""
+            INSERT INTO pipeline__watermarks (table_name, high_water, updated_at)
+            VALUES (%s, %s, now())
+            ON CONFLICT (table_name) DO UPDATE SET
+                high_water = GREATEST(pipeline__watermarks.high_water, EXCLUDED.high_water),
+                updated_at = EXCLUDED.updated_at
+        """, (table_name, int(high_water)))
+
+    def reset_watermark(self, table_name):
+        """Forget the high-water mark of the table, so it is processed from the start"""
+        self.cursor.execute("DELETE FROM pipeline__watermarks WHERE table_name = %s", (table_name,))
+
+    def get_checkpoint(self, source, target_table, source_version):
+        """Rows committed, ID offset and byte offset of an unfinished load of source into target_table, None when
+        there is no checkpoint or it belongs to another version of the source"""
+        self.cursor.execute("""
+            SELECT rows_committed, id_offset, byte_offset FROM pipeline__checkpoints
+            WHERE source = %s AND target_table = %s AND source_version = %s
+        """, (source, target_table, source_version))
+        return self.cursor.fetchone()
+
+    def save_checkpoint(self, source, target_table, source_version, rows_committed, id_offset=0, byte_offset=0):
+        """Record the rows of source written so far, committed together with them by the caller"""
+        self.cursor.execute("""
+            INSERT INTO pipeline__checkpoints
+                (source, target_table, source_version, rows_committed, id_offset, byte_offset, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, now())
+            ON CONFLICT (source, target_table) DO UPDATE SET
+                source_version = EXCLUDED.source_version,
+                rows_committed = EXCLUDED.rows_committed,
+                id_offset = EXCLUDED.id_offset,
+                byte_offset = EXCLUDED.byte_offset,
+                updated_at = EXCLUDED.updated_at
+        """, (source, target_table, source_version, int(rows_committed), int(id_offset), int(byte_offset)))
+
+    def clear_checkpoint(self, source, target_table):
+        """Forget the checkpoint of a load that finished"""
+        self.cursor.execute(
+            "DELETE FROM pipeline__checkpoints WHERE source = %s AND target_table = %s", (source, target_table)
+        )
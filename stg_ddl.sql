@@ -28,4 +28,9 @@ CREATE TABLE IF NOT EXISTS stg__attendances (
     schedule_id INTEGER,
     student_id INTEGER,
     attend_dt VARCHAR(255)
-);
\ No newline at end of file
+);
+
+CREATE INDEX IF NOT EXISTS stg__courses_id_idx ON stg__courses (id);
+CREATE INDEX IF NOT EXISTS stg__schedules_id_idx ON stg__schedules (id);
+CREATE INDEX IF NOT EXISTS stg__enrollments_id_idx ON stg__enrollments (id);
+CREATE INDEX IF NOT EXISTS stg__attendances_id_idx ON stg__attendances (id);
\ No newline at end of file
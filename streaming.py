@@ -0,0 +1,205 @@
+import queue
+import threading
+import time
+import warnings
+from psycopg2 import Error
+from config import Config
+from extract import Extractor
+from transform import Transformer
+from load import Loader
+from schemas import schema_for
+from metrics import metrics
+
+# Marks the end of the batches of one source file in a queue
+END_OF_FILE = 'end_of_file'
+# Marks the end of all batches in a queue
+END_OF_STREAM = 'end_of_stream'
+
+class StreamingPipeline:
+    """Extract, transform and load running concurrently, passing record batches through bounded queues"""
+
+    def __init__(self):
+        # A full queue blocks the stage that feeds it, so a slow stage holds back the faster ones
+        self.staging_queue = queue.Queue(maxsize=Config.STREAM_QUEUE_SIZE)
+        self.transform_queue = queue.Queue(maxsize=Config.STREAM_QUEUE_SIZE)
+        # After a failure every stage keeps draining its queue without working, so no producer stays blocked
+        self.failed = threading.Event()
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def fail(self, stage, error):
+        """Record the error of a stage and make the other stages stop working"""
+        print(f"Error in the {stage} stage of the streaming pipeline: {error}")
+        with self.lock:
+            self.errors[stage] = str(error)
+        self.failed.set()
+
+    def prepare(self):
+        """Create the pipeline tables, validate the source files and pick the files that changed"""
+        extractor = Extractor()
+        try:
+            if not extractor.validate_source_files():
+                return None
+            extractor.execute_ddl_from_file('stg_ddl.sql')
+            extractor.state.create_tables()
+
+            files = []
+            for file_path, table_name in extractor.list_csv_files():
+                if Config.INCREMENTAL:
+                    changed, fingerprint = extractor.state.check_file(file_path)
+                    if not changed:
+                        print(f"Skipping {file_path}, unchanged since the last run.")
+                        continue
+                else:
+                    fingerprint = None
+                files.append((file_path, table_name, fingerprint))
+            return files
+        finally:
+            self.errors.update(extractor.errors)
+            extractor.close_db()
+
+    def catch_up(self):
+        """Transform the staging rows a previous run left above the watermarks, before new rows are streamed"""
+        transformer = Transformer()
+        try:
+            transformer.execute_ddl_from_file('wh_ddl.sql')
+            transformer.state.create_tables()
+            transformer.add_warehouse_keys()
+            transformer.backfill_date_keys()
+            transformer.build_facts()
+            if Config.INCREMENTAL:
+                transformer.transform_and_load()
+        finally:
+            self.errors.update(transformer.errors)
+            transformer.close_db()
+
+    def read_files(self, files):
+        """Reader stage: parse the source files into chunks with their schemas"""
+        with metrics.step('stream.read'):
+            rows = 0
+            try:
+                for file_path, table_name, fingerprint in files:
+                    reader = schema_for(table_name).read_csv(file_path, parse_dates=False, chunksize=Config.CSV_CHUNK_SIZE)
+                    for chunk in reader:
+                        if self.failed.is_set():
+                            break
+                        rows += len(chunk)
+                        self.staging_queue.put((file_path, table_name, chunk))
+                    self.staging_queue.put((END_OF_FILE, file_path, table_name, fingerprint))
+            except (Exception, Error) as error:
+                self.fail('read', error)
+            finally:
+                self.staging_queue.put(END_OF_STREAM)
+                metrics.record(rows_out=rows)
+
+    def stage_batches(self):
+        """Staging stage: COPY every chunk into its staging table and forward only the rows that are new"""
+        extractor = Extractor()
+        with metrics.step('stream.stage'):
+            rows_in = 0
+            rows_out = 0
+            try:
+                while True:
+                    item = self.staging_queue.get()
+                    if item == END_OF_STREAM:
+                        break
+                    if self.failed.is_set():
+                        continue
+                    if item[0] == END_OF_FILE:
+                        # The file is recorded once all of its chunks are committed
+                        _, file_path, table_name, fingerprint = item
+                        if fingerprint is not None:
+                            extractor.state.record_file(file_path, fingerprint)
+                            extractor.connection.commit()
+                        print(f"Data from {file_path} inserted into {table_name} successfully.")
+                        continue
+
+                    file_path, table_name, chunk = item
+                    copied_rows, new_rows = extractor.stage_chunk(chunk, table_name, returning=True)
+                    extractor.connection.commit()
+                    rows_in += copied_rows
+                    rows_out += len(new_rows)
+                    if not new_rows.empty:
+                        self.transform_queue.put((table_name, new_rows))
+            except (Exception, Error) as error:
+                extractor.connection.rollback()
+                self.fail('staging', error)
+                # Keep draining so the reader is never blocked on a full queue
+                while self.staging_queue.get() != END_OF_STREAM:
+                    pass
+            finally:
+                self.transform_queue.put(END_OF_STREAM)
+                extractor.close_db()
+                metrics.record(rows_in=rows_in, rows_out=rows_out)
+
+    def transform_batches(self):
+        """Transform stage: transform the new staging rows and write them to the warehouse, one batch at a time"""
+        transformer = Transformer()
+        id_offsets = {}
+        with metrics.step('stream.transform'):
+            rows_in = 0
+            rows_out = 0
+            try:
+                while True:
+                    item = self.transform_queue.get()
+                    if item == END_OF_STREAM:
+                        break
+                    if self.failed.is_set():
+                        continue
+
+                    table_name, new_rows = item
+                    datawarehouse_table = f"wh_{table_name[4:]}"
+                    df = schema_for(table_name).compact(new_rows.sort_values('id', kind='stable').reset_index(drop=True))
+                    high_water = df['id'].max()
+
+                    # Expanded schedule sessions are numbered on from the last session in the warehouse
+                    if table_name == 'stg__schedules' and table_name not in id_offsets:
+                        transformer.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM wh__schedules")
+                        id_offsets[table_name] = transformer.cursor.fetchone()[0]
+                    transformed_df = transformer.transform_data(df, table_name, id_offsets.get(table_name, 0))
+                    if table_name in id_offsets:
+                        id_offsets[table_name] += len(transformed_df)
+
+                    rows_in += len(df)
+                    rows_out += transformer.write_rows(transformed_df, datawarehouse_table)
+                    if Config.INCREMENTAL:
+                        transformer.state.set_watermark(table_name, high_water)
+                    transformer.connection.commit()
+            except (Exception, Error) as error:
+                transformer.connection.rollback()
+                self.fail('transform', error)
+                while self.transform_queue.get() != END_OF_STREAM:
+                    pass
+            finally:
+                metrics.record(rows_in=rows_in, rows_out=rows_out)
+        transformer.close_db()
+
+    def run(self):
+        """Run the pipeline, the load stage starts once every batch is in the warehouse"""
+        warnings.filterwarnings("ignore", category=UserWarning, message="pandas only supports SQLAlchemy connectable")
+        start_time = time.perf_counter()
+        files = self.prepare()
+        if files is None:
+            print("Streaming pipeline is stopped, the source files do not match their schemas.")
+            return
+        self.catch_up()
+
+        stages = [
+            threading.Thread(target=self.read_files, args=(files,), name='stream-read'),
+            threading.Thread(target=self.stage_batches, name='stream-stage'),
+            threading.Thread(target=self.transform_batches, name='stream-transform'),
+        ]
+        for stage in stages:
+            stage.start()
+        for stage in stages:
+            stage.join()
+
+        if self.errors:
+            print(f"Streaming pipeline failed: {self.errors}")
+            return
+        print(f"Streamed {len(files)} files into the data warehouse in {time.perf_counter() - start_time:.2f}s.")
+
+        with metrics.step('stream.load'):
+            loader = Loader()
+            loader.run()
+        self.errors.update(loader.errors)
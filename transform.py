@@ -1,44 +1,142 @@
+import numpy as np
 import pandas as pd
-import psycopg2
 from psycopg2 import Error
+from psycopg2.extras import execute_values
 from config import Config
-from datetime import datetime, timedelta
+from db import PooledStage
+from state import PipelineState
+from metrics import metrics
+from snapshot import SnapshotStore
+from schemas import schema_for, to_dates
+from dates import DateDimension, date_keys, semester_end, semester_start
+import pushdown
+from datetime import datetime
+from itertools import islice
+import re
 import warnings
 
-class Transformer:
+def expand_schedule_dates(df, id_offset=0):
+    """Expand each schedule into one row per course session with array operations, numbering sessions after id_offset"""
+    start_dates = df['start_dt'].to_numpy(dtype='datetime64[D]')
+    end_dates = df['end_dt'].to_numpy(dtype='datetime64[D]')
+
+    # Number of calendar days covered by every schedule, schedules without valid dates cover none
+    valid = ~(np.isnat(start_dates) | np.isnat(end_dates))
+    day_counts = np.zeros(len(df), dtype=np.int64)
+    day_counts[valid] = (end_dates[valid] - start_dates[valid]).astype(np.int64) + 1
+    day_counts = day_counts.clip(min=0)
+
+    # One element per (schedule, calendar day), day_offsets restarts at zero for every schedule
+    schedule_index = np.repeat(np.arange(len(df)), day_counts)
+    day_offsets = np.arange(day_counts.sum()) - np.repeat(day_counts.cumsum() - day_counts, day_counts)
+    dates = start_dates[schedule_index] + day_offsets.astype('timedelta64[D]')
+
+    # Same weekday numbering as the original loop (weekday + 1 % 7 + 1), 1970-01-01 was a Thursday
+    custom_weekdays = (dates.astype(np.int64) + 3) % 7 + 2
+
+    # Bitmask of the course days of every schedule, so the weekday filter is a single array lookup
+    course_days = df['course_days'].str.split(',')
+    day_positions = np.repeat(np.arange(len(df)), course_days.str.len().to_numpy())
+    day_numbers = course_days.explode().str.strip().astype(np.int64).to_numpy()
+    in_range = (day_numbers >= 0) & (day_numbers < 63)
+    day_masks = np.zeros(len(df), dtype=np.int64)
+    np.bitwise_or.at(day_masks, day_positions[in_range], np.left_shift(1, day_numbers[in_range]))
+
+    keep = (day_masks[schedule_index] >> custom_weekdays) & 1 == 1
+    schedule_index = schedule_index[keep]
+
+    result = pd.DataFrame({
+        'course_id': df['course_id'].to_numpy()[schedule_index],
+        'lecturer_id': df['lecturer_id'].to_numpy()[schedule_index],
+        'start_dt': df['start_dt'].to_numpy()[schedule_index],
+        'end_dt': df['end_dt'].to_numpy()[schedule_index],
+        'course_day': custom_weekdays[keep],
+        'schedule_date': np.datetime_as_string(dates[keep], unit='D').astype(object),
+        'week_number': day_offsets[keep] // 7 + 1
+    })
+    result.index += 1 + id_offset
+    result.index.name = 'id'
+    result.reset_index(inplace=True)
+    return result
+
+def transform_frame(df, table_name, id_offset=0):
+    """Data transformation and manipulation of a staging table frame, shared by every engine"""
+    if table_name == "stg__schedules":
+        with metrics.step('transform.parse_dates', table=table_name, rows_in=len(df)):
+            df['start_dt'] = to_dates(df['start_dt'])
+            df['end_dt'] = to_dates(df['end_dt'])
+
+        with metrics.step('transform.expand_schedules', table=table_name, rows_in=len(df)):
+            df = expand_schedule_dates(df, id_offset)
+            df['schedule_date_key'] = date_keys(df['schedule_date'])
+            metrics.record(rows_out=len(df))
+
+    elif table_name == 'stg__enrollments':
+        with metrics.step('transform.parse_dates', table=table_name, rows_in=len(df)):
+            df['enroll_dt'] = to_dates(df['enroll_dt'])
+            df['enroll_date_key'] = date_keys(df['enroll_dt'])
+
+    elif table_name == 'stg__attendances':
+        with metrics.step('transform.parse_dates', table=table_name, rows_in=len(df)):
+            df['attend_dt'] = to_dates(df['attend_dt'])
+            df['attend_date_key'] = date_keys(df['attend_dt'])
+
+    else:
+        df = df.drop_duplicates(subset='id')
+    return df
+
+def partition_bounds(dates, interval):
+    """Unique (suffix, start, end) ranges of the partitions that hold the given dates"""
+    months = pd.to_datetime(dates, errors='coerce').dropna().dt.to_period('M').unique()
+    bounds = set()
+    for month in months:
+        if interval == 'semester':
+            year, start_month, _ = semester_start(month.year, month.month)
+            end_year, end_month = semester_end(year, start_month)
+            start = pd.Period(year=year, month=start_month, freq='M')
+            end = pd.Period(year=end_year, month=end_month, freq='M')
+        else:
+            start, end = month, month + 1
+        bounds.add((f"{start.year}_{start.month:02d}", start.start_time.date(), end.start_time.date()))
+    return sorted(bounds)
+
+class Transformer(PooledStage):
+    # Primary key of each warehouse table created by wh_ddl.sql, the conflict target when existing rows are updated
+    WAREHOUSE_KEYS = {
+        'wh__courses': ('id',),
+        'wh__schedules': ('id', 'schedule_date'),
+        'wh__enrollments': ('id',),
+        'wh__attendances': ('id', 'attend_dt'),
+    }
+
+    # Second key of a warehouse table, a session exists once per course, lecturer and date whatever its ID
+    UNIQUE_KEYS = {
+        'wh__schedules': ('course_id', 'lecturer_id', 'schedule_date'),
+    }
+
+    # Date column of each range-partitioned warehouse table
+    PARTITION_COLUMNS = {
+        'wh__schedules': 'schedule_date',
+        'wh__attendances': 'attend_dt',
+    }
+
+    # Date column of each warehouse table with the column of its wh__dim_date key
+    DATE_KEYS = {
+        'wh__schedules': ('schedule_date', 'schedule_date_key'),
+        'wh__enrollments': ('enroll_dt', 'enroll_date_key'),
+        'wh__attendances': ('attend_dt', 'attend_date_key'),
+    }
+
     def __init__(self):
-        self.connection = None
-        self.cursor = None
         self.dataframes = {}
-        self.connect_to_db()
+        self.partitions = {}
+        self.types = {}
+        self.keys = {}
+        super().__init__()
+        self.state = PipelineState(self.connection, self.cursor)
+        self.dates = DateDimension(self.connection, self.cursor)
         print("Starting transformation...")
 
-    def connect_to_db(self):
-        """Establish a connection to the PostgreSQL database"""
-        try:
-            self.connection = psycopg2.connect(
-                host=Config.DB_HOST,
-                port=Config.DB_PORT,
-                database=Config.DB_SCHEMA,
-                user=Config.DB_USER,
-                password=Config.DB_PASSWORD
-            )
-            self.cursor = self.connection.cursor()
-            print("Database connection established.")
-
-        except(Exception, Error) as error:
-            print(f"Error while connecting to PostgreSQL: {error}")
-            self.connection = None
-            self.cursor = None
-
-    def close_db(self):
-        """Close the database connection and cursor"""
-        if self.cursor:
-            self.cursor.close()
-        if self.connection:
-            self.connection.close()
-            print("PostgreSQL connection is closed.")
-
     def get_staging_tables(self):
         """Retrieve list of staging tables"""
         self.cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_name LIKE 'stg__%'")
@@ -50,62 +148,279 @@ class Transformer:
         try:
             staging_tables = self.get_staging_tables()
             for table in staging_tables:
-                df = pd.read_sql_query(f"SELECT * FROM {table}", self.connection)
-
-                # Perform data transformation
-                transformed_df = self.transform_data(df, table)
-
-                # Ingest transformed data into the data warehouse layer
-                datawarehouse_table = f"wh_{table[4:]}"
-                self.ingest_transformed_data(transformed_df, datawarehouse_table)
+                with metrics.step('transform.table', table=table):
+                    if pushdown.uses_pushdown(table):
+                        self.pushdown_transform_and_load(table)
+                    elif Config.TRANSFORM_MODE == 'stream':
+                        self.stream_transform_and_load(table)
+                    else:
+                        self.batch_transform_and_load(table)
             print("Data transformation and loading completed.")
         except(Exception, Error) as error:
             print(f"Error during data transformation and loading: {error}")
+            self.errors['transform'] = str(error)
             self.connection.rollback()
-    
-    def transform_data(self, df, table_name):
-        """Data transformation and manipulation"""
-        if table_name == "stg__schedules":
-            df['start_dt'] = pd.to_datetime(df['start_dt'], format="%d-%b-%y", errors='coerce')
-            df['end_dt'] = pd.to_datetime(df['end_dt'], format="%d-%b-%y", errors='coerce')
-
-            all_dates = []
-
-            for _, row in df.iterrows():
-                start_date = row['start_dt']
-                end_date = row['end_dt']
-                days_of_week = [int(day) for day in row['course_days'].split(',')]
-                current_date = start_date
-                while current_date <= end_date:
-                    weekday = current_date.weekday()
-                    custom_weekday = weekday + 1 % 7 + 1
-                    if custom_weekday in days_of_week:
-                        all_dates.append({
-                            'course_id': row['course_id'],
-                            'lecturer_id': row['lecturer_id'],
-                            'start_dt': row['start_dt'],
-                            'end_dt': row['end_dt'],
-                            'course_day': custom_weekday,
-                            'schedule_date': (current_date).strftime('%Y-%m-%d'),
-                            'week_number': ((current_date - start_date).days // 7) + 1
-                        })
-                    current_date += timedelta(days=1)
-
-            df = pd.DataFrame(all_dates)
-            df.reset_index(drop=True, inplace=True)
-            df.index += 1
-            df.index.name = 'id'
-            df.reset_index(inplace=True)
-
-        elif table_name == 'stg__enrollments':
-            df['enroll_dt'] = pd.to_datetime(df['enroll_dt'], format="%d-%b-%y", errors='coerce')
-
-        elif table_name == 'stg__attendances':
-            df['attend_dt'] = pd.to_datetime(df['attend_dt'], format="%d-%b-%y", errors='coerce')
 
+    def batch_transform_and_load(self, table):
+        """Read a whole staging table, transform it and load it to the data warehouse"""
+        datawarehouse_table = f"wh_{table[4:]}"
+        watermark = self.state.get_watermark(table) if Config.INCREMENTAL else None
+        snapshots = SnapshotStore.get()
+
+        # A rerun of a snapshot run loads the frames it already transformed
+        if snapshots and snapshots.exists('silver', datawarehouse_table):
+            with metrics.step('transform.read', table=datawarehouse_table, source='silver'):
+                transformed_df = snapshots.read('silver', datawarehouse_table)
+                parts_metadata = snapshots.metadata('silver', datawarehouse_table)
+                high_water = max(int(part['high_water']) for part in parts_metadata)
+                id_offset = int(parts_metadata[0].get('id_offset', 0))
+                metrics.record(rows_out=len(transformed_df))
+            if watermark is not None and high_water <= watermark:
+                print(f"No new rows in {table}.")
+                return
+            print(f"Loading {datawarehouse_table} from the silver snapshot of run {snapshots.run_id}.")
+            rows_in = len(transformed_df)
+            source_version = f"{watermark}:{high_water}"
+            checkpoint = self.resume_checkpoint(table, datawarehouse_table, source_version)
+
+        else:
+            with metrics.step('transform.read', table=table):
+                df = self.read_staging_rows(table, watermark, snapshots)
+                metrics.record(rows_out=len(df))
+            if df.empty:
+                print(f"No new rows in {table}.")
+                return
+            high_water = df['id'].max()
+            rows_in = len(df)
+            source_version = f"{watermark}:{high_water}"
+            # A resumed load numbers the sessions from the offset of the interrupted one
+            checkpoint = self.resume_checkpoint(table, datawarehouse_table, source_version)
+            id_offset = checkpoint[1] if checkpoint else self.get_id_offset(table)
+
+            # Perform data transformation
+            with metrics.step('transform.transform', table=table, rows_in=len(df)):
+                transformed_df = self.transform_data(df, table, id_offset)
+                metrics.record(rows_out=len(transformed_df))
+
+            if snapshots:
+                snapshots.clear('silver', datawarehouse_table)
+                snapshots.write('silver', datawarehouse_table, transformed_df, high_water=high_water, id_offset=id_offset)
+
+        # Ingest transformed data into the data warehouse layer
+        with metrics.step('transform.write', table=datawarehouse_table, rows_in=len(transformed_df)):
+            loaded_rows = self.ingest_transformed_data(
+                transformed_df, datawarehouse_table, source=table, source_version=source_version,
+                skip_rows=checkpoint[0] if checkpoint else 0, id_offset=id_offset
+            )
+            metrics.record(rows_out=loaded_rows)
+        metrics.record(rows_in=rows_in, rows_out=loaded_rows)
+
+        if loaded_rows is not None:
+            # The watermark replaces the checkpoint once every row is written
+            if Config.INCREMENTAL:
+                self.state.set_watermark(table, high_water)
+            self.state.clear_checkpoint(table, datawarehouse_table)
+            self.connection.commit()
+
+    def resume_checkpoint(self, table, datawarehouse_table, source_version):
+        """Rows committed and ID offset of an interrupted load of the same staging rows when the run resumes, None otherwise"""
+        if not Config.RESUME:
+            return None
+        return self.state.get_checkpoint(table, datawarehouse_table, source_version)
+
+    def read_staging_rows(self, table, watermark=None, snapshots=None):
+        """Staging rows above the watermark with the compact dtypes of the table's schema, from the bronze snapshot of the run when there is one"""
+        schema = schema_for(table)
+        df = None
+        if snapshots and snapshots.exists('bronze', table):
+            df = self.read_bronze_rows(table, watermark, snapshots)
+
+        if df is not None:
+            print(f"Reading {table} from the bronze snapshot of run {snapshots.run_id}.")
+        # Incremental runs only read the staging rows above the table's watermark
+        elif watermark is not None:
+            df = pd.read_sql_query(f"SELECT * FROM {table} WHERE id > %(watermark)s ORDER BY id",
+                                   self.connection, params={'watermark': watermark})
         else:
-            df = df.drop_duplicates(subset='id')
+            df = pd.read_sql_query(f"SELECT * FROM {table} ORDER BY id", self.connection)
+
+        df = schema.compact(df)
+        metrics.record(frame_mb=round(df.memory_usage(deep=True).sum() / (1024 * 1024), 3))
         return df
+
+    def read_bronze_rows(self, table, watermark, snapshots):
+        """Staging rows above the watermark from the bronze snapshot, None when the snapshot does not hold all of them"""
+        filters = [('id', '>', watermark)] if watermark is not None else None
+        df = snapshots.read('bronze', table, columns=list(schema_for(table).columns), filters=filters)
+        # Same rows and order as the staging table, in ID order
+        df = df.dropna(subset=['id']).drop_duplicates(subset='id').sort_values('id', kind='stable')
+
+        # The snapshot only holds the rows merged during the run, rows staged before it are read from staging
+        if watermark is not None:
+            self.cursor.execute(f"SELECT COUNT(id) FROM {table} WHERE id > %s", (watermark,))
+        else:
+            self.cursor.execute(f"SELECT COUNT(id) FROM {table}")
+        staged_rows = self.cursor.fetchone()[0]
+        if staged_rows != len(df):
+            print(f"The bronze snapshot of {table} holds {len(df)} of its {staged_rows} staging rows, reading staging.")
+            return None
+        return df.reset_index(drop=True)
+
+    def get_id_offset(self, table):
+        """Last session ID in wh__schedules, so sessions expanded in an incremental run get new IDs"""
+        if table != 'stg__schedules' or not Config.INCREMENTAL:
+            return 0
+        self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM wh__schedules")
+        return self.cursor.fetchone()[0]
+
+    def stream_transform_and_load(self, table):
+        """Read a staging table through a server-side cursor, transforming and loading one chunk at a time"""
+        datawarehouse_table = f"wh_{table[4:]}"
+        watermark = self.state.get_watermark(table) if Config.INCREMENTAL else None
+        read_rows = 0
+        loaded_rows = 0
+        id_offset = self.get_id_offset(table)
+        schema = schema_for(table)
+        snapshots = SnapshotStore.get()
+        if snapshots:
+            snapshots.clear('silver', datawarehouse_table)
+
+        cursor_name = f"stream__{table}"
+        try:
+            # WITH HOLD keeps the cursor open across the commit after every chunk
+            with self.connection.cursor(name=cursor_name, withhold=True) as stream_cursor:
+                stream_cursor.itersize = Config.TRANSFORM_CHUNK_SIZE
+                if watermark is None:
+                    stream_cursor.execute(f"SELECT * FROM {table} ORDER BY id")
+                else:
+                    stream_cursor.execute(f"SELECT * FROM {table} WHERE id > %s ORDER BY id", (watermark,))
+                while True:
+                    rows = stream_cursor.fetchmany(Config.TRANSFORM_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    df = pd.DataFrame(rows, columns=[column.name for column in stream_cursor.description])
+                    df = schema.compact(df)
+                    high_water = df['id'].max()
+                    read_rows += len(df)
+
+                    # Expanded schedule sessions keep numbering on from the previous chunk
+                    transformed_df = self.transform_data(df, table, id_offset)
+                    id_offset += len(transformed_df)
+                    if snapshots:
+                        snapshots.write('silver', datawarehouse_table, transformed_df, high_water=high_water)
+
+                    loaded_rows += self.write_rows(transformed_df, datawarehouse_table)
+                    # Rows are read in ID order, so the watermark can move with every committed chunk
+                    if watermark is not None:
+                        self.state.set_watermark(table, high_water)
+                    self.connection.commit()
+
+            metrics.record(rows_in=read_rows, rows_out=loaded_rows)
+            print(f"Data transformed and loaded into {datawarehouse_table} successfuly ({loaded_rows} rows written).")
+
+        except(Exception, Error) as error:
+            print(f"Error while streaming {table} into {datawarehouse_table}: {error}")
+            self.errors[table] = str(error)
+            self.connection.rollback()
+            self.close_held_cursor(cursor_name)
+
+    def close_held_cursor(self, cursor_name):
+        """Close a WITH HOLD cursor left open by a failed stream, it outlives the rollback of its transaction"""
+        try:
+            self.cursor.execute("SELECT 1 FROM pg_cursors WHERE name = %s", (cursor_name,))
+            if self.cursor.fetchone():
+                self.cursor.execute(f"CLOSE {cursor_name}")
+            self.connection.commit()
+
+        except(Exception, Error) as error:
+            print(f"Error while closing cursor {cursor_name}: {error}")
+            self.connection.rollback()
+
+    def pushdown_transform_and_load(self, table):
+        """Transform and load a staging table inside PostgreSQL with one INSERT ... SELECT, rows never leave the database"""
+        datawarehouse_table = f"wh_{table[4:]}"
+        watermark = self.state.get_watermark(table) if Config.INCREMENTAL else None
+        incremental = watermark is not None
+        try:
+            with metrics.step('transform.read', table=table, engine='pushdown'):
+                if incremental:
+                    self.cursor.execute(f"SELECT COUNT(*), MAX(id) FROM {table} WHERE id > %s", (watermark,))
+                else:
+                    self.cursor.execute(f"SELECT COUNT(*), MAX(id) FROM {table}")
+                rows_in, high_water = self.cursor.fetchone()
+                metrics.record(rows_out=rows_in)
+            if not rows_in:
+                print(f"No new rows in {table}.")
+                return
+            # Rows staged while the statement runs stay above the watermark for the next run
+            params = {'watermark': watermark, 'high_water': high_water, 'id_offset': self.get_id_offset(table)}
+
+            # Partitions and date dimension rows are created up front for the whole date range
+            date_range_query = pushdown.date_range_query(table, incremental)
+            if date_range_query:
+                self.cursor.execute(date_range_query, params)
+                first_date, last_date = self.cursor.fetchone()
+                if first_date is not None:
+                    days = pd.Series(pd.date_range(first_date, last_date, freq='MS').append(
+                        pd.DatetimeIndex([first_date, last_date])))
+                    if datawarehouse_table in self.PARTITION_COLUMNS:
+                        self.ensure_partitions(pd.DataFrame({self.PARTITION_COLUMNS[datawarehouse_table]: days}),
+                                               datawarehouse_table)
+                    self.dates.ensure(date_keys(days))
+
+            columns, select_query = pushdown.select_query(table, incremental)
+            with metrics.step('transform.write', table=datawarehouse_table, engine='pushdown'):
+                query = self.build_insert_query(columns, datawarehouse_table, select_query)
+                if datawarehouse_table == 'wh__schedules':
+                    self.cursor.execute(f"{query} RETURNING id", params)
+                    loaded_rows = self.cursor.rowcount
+                    self.maintain_facts(pd.DataFrame(self.cursor.fetchall(), columns=['id']), datawarehouse_table)
+                else:
+                    self.cursor.execute(query, params)
+                    loaded_rows = self.cursor.rowcount
+                    self.maintain_pushdown_facts(table, datawarehouse_table, columns, select_query, params)
+                metrics.record(rows_out=loaded_rows)
+
+            if incremental:
+                self.state.set_watermark(table, high_water)
+            self.connection.commit()
+            metrics.record(rows_in=rows_in, rows_out=loaded_rows)
+            print(f"Data transformed and loaded into {datawarehouse_table} in the database successfuly ({loaded_rows} rows written).")
+
+        except(Exception, Error) as error:
+            print(f"Error while transforming {table} in the database: {error}")
+            self.errors[table] = str(error)
+            self.connection.rollback()
+
+    def maintain_pushdown_facts(self, table, datawarehouse_table, columns, select_query, params):
+        """Update the session facts touched by a pushdown write, from the distinct keys of the transformed rows"""
+        if datawarehouse_table == 'wh__attendances':
+            key_columns = ['schedule_id', 'attend_date_key', 'attend_dt']
+        elif datawarehouse_table == 'wh__enrollments':
+            key_columns = ['schedule_id']
+        else:
+            return
+        # Only the distinct keys are read back, far fewer than the rows written
+        self.cursor.execute(f"SELECT DISTINCT {', '.join(key_columns)} FROM ({select_query}) AS t", params)
+        self.maintain_facts(pd.DataFrame(self.cursor.fetchall(), columns=key_columns), datawarehouse_table)
+
+    def load_new_rows(self, new_rows, table_name):
+        """Transform rows that were just staged and write them to the warehouse without committing, returns the rows written"""
+        df = schema_for(table_name).compact(new_rows.sort_values('id', kind='stable').reset_index(drop=True))
+        id_offset = 0
+        if table_name == 'stg__schedules':
+            # Sessions are numbered on from the last one in the warehouse
+            self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM wh__schedules")
+            id_offset = self.cursor.fetchone()[0]
+        transformed_df = self.transform_data(df, table_name, id_offset)
+        loaded_rows = self.write_rows(transformed_df, f"wh_{table_name[4:]}")
+        if Config.INCREMENTAL:
+            self.state.set_watermark(table_name, df['id'].max())
+        return loaded_rows
+
+    def transform_data(self, df, table_name, id_offset=0):
+        """Data transformation and manipulation"""
+        return transform_frame(df, table_name, id_offset)
     
     def generate_course_dates(self, start_date, end_date, course_days):
         all_dates = pd.date_range(start_date, end_date)
@@ -114,58 +429,332 @@ class Transformer:
             course_dates.extend(all_dates[all_dates.weekday == day - 1])
         return sorted(course_dates)
     
-    def execute_ddl_from_file(self, file_path):
-        """Execute DDL statements from a file"""
-        if not self.connection or not self.cursor:
-            print("No database connection available.")
-            return
+    def add_warehouse_keys(self):
+        """Add the keys of wh__schedules to a table created before it had them, dropping its duplicate sessions first"""
+        table_name = 'wh__schedules'
+        keys = {
+            'p': self.WAREHOUSE_KEYS[table_name],
+            'u': self.UNIQUE_KEYS[table_name],
+        }
+        try:
+            self.cursor.execute("""
+                SELECT con.contype FROM pg_constraint con JOIN pg_class c ON c.oid = con.conrelid
+                WHERE c.relname = %s AND con.contype IN ('p', 'u')
+            """, (table_name,))
+            existing = {row[0] for row in self.cursor.fetchall()}
+            if existing >= set(keys):
+                return
+
+            deleted_rows = 0
+            for contype, columns in keys.items():
+                if contype in existing:
+                    continue
+                matches = ' AND '.join(f"duplicate.{column} = t.{column}" for column in columns)
+                # Every run of the old loader wrote the sessions again, the first copy of each is kept
+                self.cursor.execute(f"""
+                    DELETE FROM {table_name} t USING {table_name} duplicate
+                    WHERE {matches} AND (duplicate.id, duplicate.ctid) < (t.id, t.ctid)
+                """)
+                deleted_rows += self.cursor.rowcount
+                constraint = 'PRIMARY KEY' if contype == 'p' else 'UNIQUE'
+                self.cursor.execute(f"ALTER TABLE {table_name} ADD {constraint} ({', '.join(columns)})")
+
+            if deleted_rows:
+                # Facts and mart rows counted the duplicates, they are recomputed from the remaining sessions
+                self.cursor.execute("DELETE FROM wh__fact_session_attendance")
+                for mart_source in ('wh__courses', *self.DATE_KEYS):
+                    self.state.reset_watermark(f"mart__weekly_attendance:{mart_source}")
+            self.connection.commit()
+            print(f"Keys added to {table_name}, {deleted_rows} duplicate sessions removed.")
 
+        except(Exception, Error) as error:
+            print(f"Error while adding the keys of {table_name}: {error}")
+            self.errors['keys'] = str(error)
+            self.connection.rollback()
+
+    def backfill_date_keys(self):
+        """Fill in the date keys of warehouse rows written before the date dimension existed"""
         try:
-            with open(file_path, 'r') as file:
-                ddl_statements = file.read().split(';')
-            
-            for statement in ddl_statements:
-                if statement.strip():
-                    self.cursor.execute(statement)
-                    self.connection.commit()
-            print("DDL statements executed successfully.")
+            for table_name, (date_column, key_column) in self.DATE_KEYS.items():
+                self.cursor.execute(f"""
+                    UPDATE {table_name} SET {key_column} = to_char({date_column}, 'YYYYMMDD')::integer
+                    WHERE {key_column} IS NULL AND {date_column} IS NOT NULL
+                    RETURNING {key_column}
+                """)
+                keys = {row[0] for row in self.cursor.fetchall()}
+                if keys:
+                    self.dates.ensure(sorted(keys))
+                    # The mart takes its semesters from the date dimension now, so it is recomputed from scratch
+                    for mart_source in ('wh__courses', *self.DATE_KEYS):
+                        self.state.reset_watermark(f"mart__weekly_attendance:{mart_source}")
+                    print(f"Date keys of {len(keys)} dates filled in {table_name}.")
+            self.connection.commit()
 
-        except (Exception, Error) as error:
-            print(f"Error while executing DDL statements: {error}")
+        except(Exception, Error) as error:
+            print(f"Error while filling in date keys: {error}")
+            self.errors['date_keys'] = str(error)
             self.connection.rollback()
-    
-    def ingest_transformed_data(self, df, table_name):
-        """Insert the transformed data to datawarehouse table"""
-        if not self.connection or not self.cursor:
-            print("No database connection available.")
-            return
+
+    def session_facts_query(self, session_filter):
+        """INSERT of the session facts of the wh__schedules rows matching session_filter, with their current counts"""
+        return f"""
+            INSERT INTO wh__fact_session_attendance
+                (schedule_id, schedule_date_key, course_id, semester, week_number, attended, enrolled)
+            SELECT
+                s.id,
+                s.schedule_date_key,
+                s.course_id,
+                d.semester,
+                s.week_number,
+                (SELECT COUNT(a.student_id) FROM wh__attendances AS a
+                 WHERE a.schedule_id = s.course_id AND a.attend_date_key = s.schedule_date_key
+                     AND a.attend_dt = s.schedule_date),
+                (SELECT COUNT(e.student_id) FROM wh__enrollments AS e
+                 WHERE e.schedule_id = s.course_id)
+            FROM wh__schedules AS s
+            LEFT JOIN wh__dim_date AS d
+                ON d.date_key = s.schedule_date_key
+            WHERE s.schedule_date_key IS NOT NULL{session_filter}
+            ON CONFLICT (schedule_id, schedule_date_key) DO UPDATE SET
+                course_id = EXCLUDED.course_id,
+                semester = EXCLUDED.semester,
+                week_number = EXCLUDED.week_number,
+                attended = EXCLUDED.attended,
+                enrolled = EXCLUDED.enrolled
+        """
+
+    def build_facts(self):
+        """Build wh__fact_session_attendance from the whole warehouse when it is empty but sessions exist"""
         try:
-            for row in df.itertuples(index=False):
-                id_value = row.id
+            self.cursor.execute("SELECT EXISTS (SELECT 1 FROM wh__fact_session_attendance)")
+            if self.cursor.fetchone()[0]:
+                return
+            with metrics.step('transform.build_facts'):
+                self.cursor.execute(self.session_facts_query(""))
+                fact_rows = self.cursor.rowcount
+                metrics.record(rows_out=fact_rows)
+                self.connection.commit()
+            if fact_rows:
+                print(f"Session facts built for {fact_rows} existing sessions.")
+
+        except(Exception, Error) as error:
+            print(f"Error while building session facts: {error}")
+            self.errors['facts'] = str(error)
+            self.connection.rollback()
+
+    def maintain_facts(self, df, table_name):
+        """Bring the session facts touched by rows just written to a warehouse table up to date, without committing
+
+        Counts are recounted for the touched sessions rather than incremented, so rows skipped by
+        ON CONFLICT or rewritten by it are counted exactly once.
+        """
+        if df.empty:
+            return
+        if table_name == 'wh__schedules':
+            session_ids = [int(session_id) for session_id in pd.unique(df['id'])]
+            self.cursor.execute(self.session_facts_query(" AND s.id = ANY(%s)"), (session_ids,))
+
+        elif table_name == 'wh__attendances':
+            keys = df[['schedule_id', 'attend_date_key', 'attend_dt']].dropna().drop_duplicates(
+                subset=['schedule_id', 'attend_date_key'])
+            dates = pd.to_datetime(keys['attend_dt']).dt.strftime('%Y-%m-%d')
+            # The date is the partition key of wh__attendances, so each recount only reads the partition of its date
+            execute_values(self.cursor, """
+                UPDATE wh__fact_session_attendance AS f
+                SET attended = (
+                    SELECT COUNT(a.student_id) FROM wh__attendances AS a
+                    WHERE a.schedule_id = f.course_id AND a.attend_date_key = f.schedule_date_key
+                        AND a.attend_dt = k.attend_dt
+                )
+                FROM (VALUES %s) AS k (course_id, date_key, attend_dt)
+                WHERE f.course_id = k.course_id AND f.schedule_date_key = k.date_key
+            """, [(int(course_id), int(date_key), date) for course_id, date_key, date
+                  in zip(keys['schedule_id'], keys['attend_date_key'], dates)],
+                template="(%s, %s, %s::date)", page_size=Config.WH_BATCH_SIZE)
 
-                # Check whether ID is already exist in the table or not
-                self.cursor.execute(f"SELECT 1 FROM {table_name} WHERE id = %s;", (id_value,))
-                exists = self.cursor.fetchone()
+        elif table_name == 'wh__enrollments':
+            course_ids = [int(course_id) for course_id in pd.unique(df['schedule_id'].dropna())]
+            self.cursor.execute("""
+                UPDATE wh__fact_session_attendance AS f
+                SET enrolled = (
+                    SELECT COUNT(e.student_id) FROM wh__enrollments AS e
+                    WHERE e.schedule_id = f.course_id
+                )
+                WHERE f.course_id = ANY(%s)
+            """, (course_ids,))
 
-                if not exists:
-                    # Only add new one that the ID is not exist in the table
-                    columns = ', '.join(df.columns)
-                    values = ', '.join(['%s'] * len(df.columns))
-                    insert_query = f"INSERT INTO {table_name} ({columns}) VALUES ({values})"
+    def build_upsert_query(self, columns, table_name):
+        """Build the batched INSERT ... ON CONFLICT statement for a warehouse table"""
+        rows_query = "VALUES %s"
+        if Config.WH_CONFLICT_ACTION == 'update' and table_name in self.UNIQUE_KEYS:
+            # The VALUES list is read as a subquery below, its text literals get the types of the table columns
+            types = self.column_types(table_name)
+            casts = ', '.join(f"{column}::{types[column]}" for column in columns)
+            rows_query = f"SELECT {casts} FROM (VALUES %s) AS new_rows ({', '.join(columns)})"
+        return self.build_insert_query(columns, table_name, rows_query)
+
+    def build_insert_query(self, columns, table_name, rows_query):
+        """INSERT ... ON CONFLICT of the rows of a VALUES list or a SELECT into a warehouse table"""
+        column_list = ', '.join(columns)
+        unique_key = self.UNIQUE_KEYS.get(table_name)
+        if Config.WH_CONFLICT_ACTION == 'update' and unique_key:
+            # ON CONFLICT DO UPDATE only handles the primary key, so a session already taken by another ID, in the
+            # table or earlier in the same rows, is skipped here as ON CONFLICT DO NOTHING would skip it
+            key_list = ', '.join(unique_key)
+            matches = ' AND '.join(f"existing.{column} = new_rows.{column}" for column in unique_key)
+            rows_query = f"""
+                SELECT DISTINCT ON ({key_list}) * FROM ({rows_query}) AS new_rows ({column_list})
+                WHERE NOT EXISTS (SELECT 1 FROM {table_name} existing WHERE {matches} AND existing.id <> new_rows.id)
+                ORDER BY {key_list}, id
+            """
+        return f"INSERT INTO {table_name} ({column_list}) {rows_query} {self.conflict_clause(columns, table_name)}"
+
+    def conflict_clause(self, columns, table_name):
+        """ON CONFLICT clause of the writes to a warehouse table, following WH_CONFLICT_ACTION"""
+        if Config.WH_CONFLICT_ACTION == 'update':
+            keys = self.primary_key(table_name)
+            updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column not in keys)
+            return f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {updates}"
+        return "ON CONFLICT DO NOTHING"
+
+    def primary_key(self, table_name):
+        """Columns of the primary key the table actually has, tables created before partitioning keep their key on id"""
+        if table_name not in self.keys:
+            self.cursor.execute("""
+                SELECT a.attname FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indrelid
+                JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+                WHERE c.relname = %s AND i.indisprimary
+                ORDER BY array_position(i.indkey::smallint[], a.attnum)
+            """, (table_name,))
+            self.keys[table_name] = tuple(row[0] for row in self.cursor.fetchall()) or \
+                self.WAREHOUSE_KEYS.get(table_name, ('id',))
+        return self.keys[table_name]
+
+    def column_types(self, table_name):
+        """SQL type of every column of a warehouse table"""
+        if table_name not in self.types:
+            self.cursor.execute("""
+                SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+                FROM pg_attribute a JOIN pg_class c ON c.oid = a.attrelid
+                WHERE c.relname = %s AND a.attnum > 0 AND NOT a.attisdropped
+            """, (table_name,))
+            self.types[table_name] = dict(self.cursor.fetchall())
+        return self.types[table_name]
+
+    def is_partitioned(self, table_name):
+        """Whether the warehouse table was created as a partitioned table"""
+        self.cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = %s",
+            (table_name,)
+        )
+        return self.cursor.fetchone() is not None
+
+    def ensure_partitions(self, df, table_name):
+        """Create the missing date partitions for the rows about to be written"""
+        if table_name not in self.PARTITION_COLUMNS:
+            return
+        # Known partitions are cached per table, None marks a table that is not partitioned
+        if table_name not in self.partitions:
+            self.partitions[table_name] = set() if self.is_partitioned(table_name) else None
+        known_partitions = self.partitions[table_name]
+        if known_partitions is None:
+            return
 
-                    self.cursor.execute(insert_query, tuple(row))
+        for suffix, start, end in partition_bounds(df[self.PARTITION_COLUMNS[table_name]], Config.WH_PARTITION_INTERVAL):
+            partition = f"{table_name}_{suffix}"
+            if partition in known_partitions:
+                continue
+            self.cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table_name} FOR VALUES FROM (%s) TO (%s)",
+                (start, end)
+            )
+            known_partitions.add(partition)
 
+    def detach_partitions_before(self, table_name, cutoff_date, drop=False):
+        """Detach (and optionally drop) the partitions that only hold dates before cutoff_date"""
+        try:
+            self.cursor.execute("""
+                SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE p.relname = %s
+            """, (table_name,))
+            detached = []
+            for partition, bound in self.cursor.fetchall():
+                upper = re.search(r"TO \('([^']+)'\)", bound)
+                if upper and pd.Timestamp(upper.group(1)) <= pd.Timestamp(cutoff_date):
+                    self.cursor.execute(f"ALTER TABLE {table_name} DETACH PARTITION {partition}")
+                    if drop:
+                        self.cursor.execute(f"DROP TABLE {partition}")
+                    detached.append(partition)
             self.connection.commit()
-            print(f"Data transformed and loaded into {table_name} successfuly.")
+            self.partitions.pop(table_name, None)
+            print(f"{'Dropped' if drop else 'Detached'} {len(detached)} partitions of {table_name} before {cutoff_date}.")
+            return detached
+
+        except(Exception, Error) as error:
+            print(f"Error while detaching partitions of {table_name}: {error}")
+            self.errors['detach'] = str(error)
+            self.connection.rollback()
+
+    def write_rows(self, df, table_name):
+        """Write the rows in batches without committing, each batch is a single multi-row statement"""
+        self.ensure_partitions(df, table_name)
+        if table_name in self.DATE_KEYS:
+            self.dates.ensure(df[self.DATE_KEYS[table_name][1]])
+        upsert_query = self.build_upsert_query(df.columns, table_name)
+        rows = df.itertuples(index=False, name=None)
+        loaded_rows = 0
+
+        while True:
+            batch = list(islice(rows, Config.WH_BATCH_SIZE))
+            if not batch:
+                break
+            execute_values(self.cursor, upsert_query, batch, page_size=len(batch))
+            loaded_rows += self.cursor.rowcount
+        self.maintain_facts(df, table_name)
+        return loaded_rows
+
+    def ingest_transformed_data(self, df, table_name, source=None, source_version=None, skip_rows=0, id_offset=0):
+        """Insert the transformed data to datawarehouse table
+
+        With a source, rows are committed TRANSFORM_CHUNK_SIZE at a time together with a checkpoint of the
+        rows written so far, and the first skip_rows rows, committed by an interrupted run, are skipped.
+        """
+        if not self.connection or not self.cursor:
+            print("No database connection available.")
+            return
+        try:
+            if source is None:
+                loaded_rows = self.write_rows(df, table_name)
+                self.connection.commit()
+            else:
+                if skip_rows:
+                    print(f"Resuming {table_name} after {skip_rows} committed rows.")
+                loaded_rows = 0
+                for start in range(skip_rows, len(df), Config.TRANSFORM_CHUNK_SIZE):
+                    chunk = df.iloc[start:start + Config.TRANSFORM_CHUNK_SIZE]
+                    loaded_rows += self.write_rows(chunk, table_name)
+                    self.state.save_checkpoint(source, table_name, source_version, start + len(chunk), id_offset)
+                    self.connection.commit()
+            print(f"Data transformed and loaded into {table_name} successfuly ({loaded_rows} rows written).")
+            return loaded_rows
 
         except(Exception, Error) as error:
             print(f"Error while inserting transformed data into {table_name}: {error}")
+            self.errors[table_name] = str(error)
             self.connection.rollback()
         
     def run(self):
         warnings.filterwarnings("ignore", category=UserWarning, message="pandas only supports SQLAlchemy connectable")
         ddl_file_path = "wh_ddl.sql"
         self.execute_ddl_from_file(ddl_file_path)
+        self.state.create_tables()
+        self.add_warehouse_keys()
+        self.backfill_date_keys()
+        self.build_facts()
         self.transform_and_load()
         self.close_db()
         print("Transformation process is finished.")
@@ -0,0 +1,200 @@
+import io
+import os
+import time
+import warnings
+from psycopg2 import Error
+from config import Config
+from extract import Extractor
+from transform import Transformer
+from load import Loader
+from schemas import SchemaError, record_end, schema_for, source_of_file
+from metrics import metrics
+
+# Source version of the checkpoints of the watch mode, their byte offset is the end of the last line loaded
+WATCH_VERSION = 'watch'
+
+class Watcher:
+    """Long-running mode polling a directory and loading the records appended to its CSV files as micro-batches"""
+    # Bytes read from one file per poll, the rest of a large file is read by the following polls
+    MAX_BATCH_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, path=None, interval=None):
+        self.path = path or Config.WATCH_PATH or Config.SOURCE_PATH
+        self.interval = Config.WATCH_INTERVAL if interval is None else interval
+        self.extractor = None
+        self.transformer = None
+        self.loader = None
+        # Size and modification time of each file when it was last read to its end
+        self.seen = {}
+        # Byte offset after the last line loaded and number of rows loaded, per file
+        self.offsets = {}
+        self.rows = {}
+        self.batches = 0
+        self.catch_up = False
+
+    def start(self):
+        """Create the pipeline tables, transform the rows left in staging and prepare the mart"""
+        self.extractor = Extractor()
+        self.extractor.execute_ddl_from_file('stg_ddl.sql')
+        self.extractor.state.create_tables()
+        self.transformer = Transformer()
+        self.transformer.execute_ddl_from_file('wh_ddl.sql')
+        self.transformer.add_warehouse_keys()
+        self.transformer.backfill_date_keys()
+        self.transformer.build_facts()
+        self.transformer.transform_and_load()
+        self.loader = Loader()
+        self.loader.create_table()
+
+    def stop(self):
+        """Return the connections of every stage to the pool"""
+        for stage in (self.extractor, self.transformer, self.loader):
+            if stage:
+                stage.close_db()
+
+    def initial_offset(self, file_path, table_name):
+        """Where to start reading a file: after the last line a previous watch loaded, after its end when an earlier
+        run ingested this version of it, or at its start"""
+        checkpoint = self.extractor.state.get_checkpoint(file_path, table_name, WATCH_VERSION)
+        if checkpoint and checkpoint[2] <= os.path.getsize(file_path):
+            self.rows[file_path] = checkpoint[0]
+            self.extractor.connection.commit()
+            return checkpoint[2]
+        self.rows[file_path] = 0
+        changed, _ = self.extractor.state.check_file(file_path)
+        # No transaction stays open on the extractor connection between polls
+        self.extractor.connection.commit()
+        return 0 if changed else os.path.getsize(file_path)
+
+    def read_new_records(self, file_path, table_name, offset):
+        """Complete records of a file after offset parsed with its schema, with the offset after the last of them"""
+        with open(file_path, 'rb') as file:
+            file.seek(offset)
+            data = file.read(self.MAX_BATCH_BYTES)
+        # A record still being written is left for a later poll, a newline inside a quoted field does not end it
+        end = record_end(data)
+        data = data[:end]
+        if offset == 0:
+            data = data[data.find(b'\n') + 1:]
+        if not data.strip():
+            return None, offset + end
+
+        schema = schema_for(table_name)
+        records = schema.read_csv(io.BytesIO(data), parse_dates=False, columns=schema.read_header(file_path))
+        return records, offset + end
+
+    def poll(self):
+        """New records of every file that changed since the last poll, as (file, table, records, end offset)"""
+        batch = []
+        # Files come in name order, so dated files like attendances_20241017.csv load oldest first
+        for file_path, _ in self.extractor.list_csv_files(self.path):
+            try:
+                stat = os.stat(file_path)
+                if self.seen.get(file_path) == (stat.st_size, stat.st_mtime):
+                    continue
+                # Every file whose name starts with a source name is appended to the staging table of that source
+                try:
+                    table_name = f"stg__{source_of_file(file_path)}"
+                except SchemaError:
+                    # Other files are reported once and skipped until they change
+                    self.seen[file_path] = (stat.st_size, stat.st_mtime)
+                    raise
+                if file_path not in self.offsets:
+                    self.offsets[file_path] = self.initial_offset(file_path, table_name)
+                if stat.st_size < self.offsets[file_path]:
+                    # A file replaced by a shorter one is read again, rows already staged are skipped by the merge
+                    print(f"{file_path} was replaced, reading it from the start.")
+                    self.offsets[file_path] = 0
+                    self.rows[file_path] = 0
+
+                records, end = self.read_new_records(file_path, table_name, self.offsets[file_path])
+                # The file is done once a poll reads up to its end, a larger rest is read by the next polls
+                if end >= stat.st_size or records is None:
+                    self.seen[file_path] = (stat.st_size, stat.st_mtime)
+                if records is None:
+                    self.offsets[file_path] = end
+                else:
+                    batch.append((file_path, table_name, records, end))
+
+            except (OSError, SchemaError, ValueError) as error:
+                print(f"Skipping {file_path} in this poll: {error}")
+        return batch
+
+    def load_batch(self, batch, poll_time):
+        """Stage, transform and load the new records, then refresh the mart rows they touch and the report"""
+        self.batches += 1
+        start_time = time.perf_counter()
+        with metrics.step('watch.batch', batch=self.batches, files=len(batch)):
+            rows_in = 0
+            rows_out = 0
+            try:
+                if self.catch_up:
+                    # Rows staged by a batch whose transform failed
+                    self.transformer.transform_and_load()
+                    self.catch_up = False
+
+                for file_path, table_name, records, end in batch:
+                    _, new_rows = self.extractor.stage_chunk(records, table_name, returning=True)
+                    self.rows[file_path] += len(records)
+                    self.extractor.state.save_checkpoint(file_path, table_name, WATCH_VERSION, self.rows[file_path],
+                                                         byte_offset=end)
+                    self.extractor.connection.commit()
+                    self.offsets[file_path] = end
+                    rows_in += len(records)
+
+                    if not new_rows.empty:
+                        try:
+                            rows_out += self.transformer.load_new_rows(new_rows, table_name)
+                            self.transformer.connection.commit()
+                        except (Exception, Error):
+                            self.transformer.connection.rollback()
+                            self.catch_up = True
+                            raise
+
+            except (Exception, Error) as error:
+                self.extractor.connection.rollback()
+                # Files whose records were not loaded are read again by the next poll
+                for file_path, _, _, end in batch:
+                    if self.offsets[file_path] != end:
+                        self.seen.pop(file_path, None)
+                print(f"Error while loading watch batch {self.batches}: {error}")
+                metrics.record(error=str(error))
+                return
+
+            if Config.MART_REFRESH == 'incremental':
+                self.loader.refresh_mart()
+            else:
+                self.loader.rebuild_mart()
+            self.loader.export_report()
+
+            elapsed = time.perf_counter() - start_time
+            # Latency from the poll that found the records, and from the last change of their files
+            latency = time.time() - poll_time
+            freshness = time.time() - max(os.stat(file_path).st_mtime for file_path, *_ in batch)
+            rows_per_second = rows_in / elapsed if elapsed > 0 else 0
+            metrics.record(rows_in=rows_in, rows_out=rows_out, latency_s=round(latency, 3),
+                           freshness_s=round(freshness, 3), rows_per_second=round(rows_per_second, 1))
+            print(f"Watch batch {self.batches}: {rows_in} new records from {len(batch)} files, {rows_out} warehouse rows "
+                  f"written in {elapsed:.2f}s ({rows_per_second:,.0f} rows/s), report updated {latency:.2f}s after "
+                  f"the poll and {freshness:.2f}s after the last file change.")
+
+    def run(self, max_polls=None):
+        """Poll every WATCH_INTERVAL seconds until interrupted, or for max_polls polls"""
+        warnings.filterwarnings("ignore", category=UserWarning, message="pandas only supports SQLAlchemy connectable")
+        try:
+            self.start()
+            print(f"Watching {self.path} every {self.interval}s, press Ctrl+C to stop.")
+            polls = 0
+            while max_polls is None or polls < max_polls:
+                poll_time = time.time()
+                batch = self.poll()
+                if batch:
+                    self.load_batch(batch, poll_time)
+                polls += 1
+                if max_polls is None or polls < max_polls:
+                    time.sleep(max(0, self.interval - (time.time() - poll_time)))
+        except KeyboardInterrupt:
+            print("Watch mode is stopped.")
+        finally:
+            self.stop()
+            print(f"Watch mode loaded {self.batches} batches.")
@@ -5,6 +5,7 @@ CREATE TABLE IF NOT EXISTS wh__courses (
     name VARCHAR(255) NOT NULL
 );
 
+-- wh__schedules and wh__attendances are range partitioned by date, partitions are created by the Transformer
 CREATE TABLE IF NOT EXISTS wh__schedules (
     id INTEGER NOT NULL,
     course_id INTEGER NOT NULL,
@@ -13,10 +14,13 @@ CREATE TABLE IF NOT EXISTS wh__schedules (
     end_dt DATE NOT NULL,
     course_day INTEGER NOT NULL,
     schedule_date DATE NOT NULL,
-    week_number INTEGER NOT NULL
+    week_number INTEGER NOT NULL,
+    schedule_date_key INTEGER,
+    PRIMARY KEY (id, schedule_date),
+    UNIQUE (course_id, lecturer_id, schedule_date)
     --course_days VARCHAR(255) NOT NULL
     --FOREIGN KEY (course_id) REFERENCES course (id)
-);
+) PARTITION BY RANGE (schedule_date);
 
 CREATE TABLE IF NOT EXISTS wh__enrollments (
     id SERIAL PRIMARY KEY,
@@ -24,14 +28,64 @@ CREATE TABLE IF NOT EXISTS wh__enrollments (
     schedule_id INTEGER NOT NULL,
     academic_year VARCHAR(9) NOT NULL,
     semester INTEGER NOT NULL CHECK (semester IN (1, 2)),
-    enroll_dt DATE NOT NULL
+    enroll_dt DATE NOT NULL,
+    enroll_date_key INTEGER
     --FOREIGN KEY (schedule_id) REFERENCES schedule (id)
 );
 
 CREATE TABLE IF NOT EXISTS wh__attendances (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     student_id INTEGER NOT NULL,
     schedule_id INTEGER NOT NULL,
-    attend_dt DATE NOT NULL
+    attend_dt DATE NOT NULL,
+    attend_date_key INTEGER,
+    PRIMARY KEY (id, attend_dt)
     --FOREIGN KEY (schedule_id) REFERENCES schedule (id)
-);
\ No newline at end of file
+) PARTITION BY RANGE (attend_dt);
+
+-- Date keys of tables created before the date dimension, filled in by the Transformer
+ALTER TABLE wh__schedules ADD COLUMN IF NOT EXISTS schedule_date_key INTEGER;
+ALTER TABLE wh__enrollments ADD COLUMN IF NOT EXISTS enroll_date_key INTEGER;
+ALTER TABLE wh__attendances ADD COLUMN IF NOT EXISTS attend_date_key INTEGER;
+
+-- Calendar attributes of every date the warehouse references, date_key is YYYYMMDD
+CREATE TABLE IF NOT EXISTS wh__dim_date (
+    date_key INTEGER PRIMARY KEY,
+    calendar_date DATE NOT NULL UNIQUE,
+    weekday INTEGER NOT NULL,
+    course_day INTEGER NOT NULL,
+    academic_year VARCHAR(9) NOT NULL,
+    semester INTEGER NOT NULL,
+    semester_start DATE NOT NULL,
+    week_of_term INTEGER NOT NULL
+);
+
+-- The session facts replace the attendance and enrollment aggregate views
+DROP MATERIALIZED VIEW IF EXISTS wh__agg_attendances;
+DROP MATERIALIZED VIEW IF EXISTS wh__agg_enrollments;
+
+-- One row per schedule session with its attended and enrolled counts, maintained by the Transformer.
+-- Like the weekly report, attendances and enrollments count towards the sessions whose course_id is
+-- their schedule_id
+CREATE TABLE IF NOT EXISTS wh__fact_session_attendance (
+    schedule_id INTEGER NOT NULL,
+    schedule_date_key INTEGER NOT NULL,
+    course_id INTEGER NOT NULL,
+    semester INTEGER,
+    week_number INTEGER NOT NULL,
+    attended BIGINT NOT NULL,
+    enrolled BIGINT NOT NULL,
+    PRIMARY KEY (schedule_id, schedule_date_key)
+);
+
+CREATE INDEX IF NOT EXISTS wh__fact_session_attendance_course_date_idx ON wh__fact_session_attendance (course_id, schedule_date_key);
+
+-- Keys of the session fact maintenance, covering the columns it reads
+DROP INDEX IF EXISTS wh__schedules_course_date_idx;
+DROP INDEX IF EXISTS wh__attendances_schedule_date_idx;
+
+CREATE INDEX IF NOT EXISTS wh__schedules_course_date_key_idx ON wh__schedules (course_id, schedule_date_key) INCLUDE (week_number);
+
+CREATE INDEX IF NOT EXISTS wh__attendances_schedule_date_key_idx ON wh__attendances (schedule_id, attend_date_key) INCLUDE (student_id);
+
+CREATE INDEX IF NOT EXISTS wh__enrollments_schedule_idx ON wh__enrollments (schedule_id) INCLUDE (student_id)
\ No newline at end of file